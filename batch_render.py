@@ -0,0 +1,194 @@
+"""
+Render the reference figure for many styles at once.
+
+Renders every built-in style and the `.mplstyle` files of the given
+directories across a process pool, then writes a contact sheet of all the
+PNGs. Styles whose outputs are up to date (same content hash of the style,
+size, formats, matplotlib version and plotting code) are skipped.
+
+    python batch_render.py -o previews --styles-dir my_styles --format png svg
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Sequence
+
+import matplotlib as mpl
+import matplotlib.style
+from PIL import Image, ImageDraw
+
+import style_sheets_reference
+from render import release_figure
+from style_sheets_reference import plot_figure
+
+MANIFEST = "manifest.json"
+
+
+def builtin_styles() -> list[str]:
+    # Same order as the reference script: `default` and `classic` first,
+    # internal styles with leading underscores excluded.
+    return ["default", "classic"] + sorted(
+        style
+        for style in mpl.style.available
+        if style != "classic" and not style.startswith("_")
+    )
+
+
+def find_styles(styles_dirs: Sequence[str], builtin: bool = True) -> dict[str, str]:
+    """Map output names to style specs (built-in names or file paths)."""
+    styles = {name: name for name in builtin_styles()} if builtin else {}
+    for styles_dir in styles_dirs:
+        for path in sorted(Path(styles_dir).glob("*.mplstyle")):
+            styles[path.stem] = str(path)
+    return styles
+
+
+def style_hash(spec: str, figsize_px: Sequence[float], formats: Sequence[str]) -> str:
+    if os.path.isfile(spec):
+        content = Path(spec).read_text()
+    elif spec == "default":
+        content = ""
+    else:
+        content = repr(sorted(mpl.style.library[spec].items()))
+    payload = json.dumps(
+        [
+            content,
+            list(figsize_px),
+            sorted(formats),
+            mpl.__version__,
+            Path(style_sheets_reference.__file__).read_text(),
+        ]
+    )
+    return hashlib.sha256(payload.encode("utf8")).hexdigest()
+
+
+def render_style(
+    name: str,
+    spec: str,
+    figsize_px: Sequence[float],
+    formats: Sequence[str],
+    output: str,
+) -> None:
+    with mpl.rc_context(), mpl.style.context(spec):
+        fig = plot_figure(figsize_px)
+        for fmt in formats:
+            fig.savefig(Path(output) / f"{name}.{fmt}", format=fmt)
+    release_figure(fig)
+
+
+def contact_sheet(paths: Sequence[Path], out: Path, ncols: int = 0) -> None:
+    """Tile the images in `paths` on a grid, with their names below them."""
+    images = [Image.open(p).convert("RGB") for p in paths]
+    ncols = ncols or math.ceil(math.sqrt(len(images)))
+    nrows = math.ceil(len(images) / ncols)
+    width = max(im.width for im in images)
+    height = max(im.height for im in images)
+    label = 20
+    sheet = Image.new("RGB", (ncols * width, nrows * (height + label)), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (path, im) in enumerate(zip(paths, images)):
+        row, col = divmod(i, ncols)
+        x, y = col * width, row * (height + label)
+        sheet.paste(im, (x, y))
+        draw.text((x + 5, y + height + 4), path.stem, fill="black")
+    sheet.save(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render the reference figure for many styles."
+    )
+    parser.add_argument("-o", "--output", default="previews", help="output directory")
+    parser.add_argument(
+        "--styles-dir",
+        action="append",
+        default=[],
+        help="directory of .mplstyle files, can be repeated",
+    )
+    parser.add_argument(
+        "--no-builtin", action="store_true", help="skip the built-in styles"
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        default=["png"],
+        choices=["png", "svg"],
+        help="output formats",
+    )
+    parser.add_argument(
+        "--size",
+        nargs=2,
+        type=float,
+        default=(1200, 600),
+        metavar=("WIDTH", "HEIGHT"),
+        help="figure size in pixels",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="render styles even if up to date"
+    )
+    parser.add_argument(
+        "--contact-sheet",
+        default="contact_sheet.png",
+        help="file name of the contact sheet in the output directory",
+    )
+    args = parser.parse_args(argv)
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    manifest_path = output / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    styles = find_styles(args.styles_dir, builtin=not args.no_builtin)
+    hashes = {
+        name: style_hash(spec, args.size, args.format) for name, spec in styles.items()
+    }
+    todo = [
+        name
+        for name in styles
+        if args.force
+        or manifest.get(name) != hashes[name]
+        or not all((output / f"{name}.{fmt}").exists() for fmt in args.format)
+    ]
+    print(f"{len(styles) - len(todo)} styles up to date, rendering {len(todo)}")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(
+                render_style, name, styles[name], args.size, args.format, str(output)
+            ): name
+            for name in todo
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(name)
+                manifest.pop(name, None)
+                print(f"Failed to render {name}: {e}")
+            else:
+                manifest[name] = hashes[name]
+                print(f"Rendered {name}")
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    sheet = output / args.contact_sheet
+    if "png" not in args.format:
+        print("Skipping the contact sheet, it requires the png format")
+    elif todo or not sheet.exists():
+        paths = [output / f"{name}.png" for name in styles if name not in failed]
+        contact_sheet([p for p in paths if p.exists()], sheet)
+        print(f"Wrote {sheet}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,284 @@
+"""
+Benchmarks of the rerun and render hot paths.
+
+    python benchmark.py -o results.json
+    python benchmark.py --compare results.json --threshold 0.2
+
+Results are saved as JSON. With `--compare`, benchmarks whose median time
+grew by more than `--threshold` relative to the baseline are reported as
+regressions and the command exits non-zero.
+"""
+
+import argparse
+import importlib.metadata
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypedDict
+
+import matplotlib as mpl
+import matplotlib.style
+
+from batch_render import builtin_styles
+from font_catalog import compile_catalog
+from helper import RCHelper, RCOverrides
+from history import EditHistory
+from key_index import key_index
+from rc_schema import compile_schema, get_keys_options, load_schema
+from render import RenderCache, release_figure, render_figure
+from style_io import export_style, style_overrides
+from style_sheets_reference import plot_figure
+from widgets import widget_description, widget_table
+
+ROOT = Path(__file__).resolve().parent
+APP = ROOT / "streamlit-matplotlib-style-app.py"
+
+
+class Timing(TypedDict):
+    repeat: int
+    min: float
+    median: float
+    mean: float
+
+
+def measure(func: Callable[[], object], repeat: int) -> Timing:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return Timing(
+        repeat=repeat,
+        min=min(times),
+        median=statistics.median(times),
+        mean=statistics.fmean(times),
+    )
+
+
+def cases(quick: bool = False) -> Iterator[tuple[str, Callable[[], Callable]]]:
+    """Benchmark names with factories doing their setup and returning them."""
+    styles = ["default", "classic", "ggplot"] if quick else builtin_styles()
+    sizes = [(960, 480)] if quick else [(500, 250), (960, 480), (1280, 640)]
+    for style in styles:
+        for size in sizes:
+
+            def plot(style=style, size=size):
+                def run():
+                    with mpl.rc_context(), mpl.style.context(style):
+                        fig = plot_figure(size)
+                        fig.canvas.draw()
+                    release_figure(fig)
+
+                return run
+
+            yield f"plot_figure[{style}-{size[0]}x{size[1]}]", plot
+
+    def render_cold():
+        return lambda: render_figure({}, (960, 480), RenderCache())
+
+    yield "render_figure[cold]", render_cold
+
+    def render_draft():
+        return lambda: render_figure({}, (960, 480), RenderCache(), 50, draft=True)
+
+    yield "render_figure[draft]", render_draft
+
+    def render_low_detail():
+        return lambda: render_figure({}, (960, 480), RenderCache(), detail=3)
+
+    yield "render_figure[detail 3]", render_low_detail
+
+    def widget_descriptions():
+        select_options = get_keys_options()
+        keys = RCHelper.get_sorted_keys(RCHelper.default())
+
+        def run():
+            for key in keys:
+                RCHelper.get_input_widget_description(
+                    key, select_options=select_options, widget_is_picker=False
+                )
+
+        return run
+
+    yield "get_input_widget_description[all keys]", widget_descriptions
+
+    def widget_table_lookups():
+        widget_table()  # Built once per process
+        keys = RCHelper.sorted_keys()
+
+        def run():
+            for key in keys:
+                widget_description(key)
+
+        return run
+
+    yield "widget_description[all keys]", widget_table_lookups
+
+    def write_binary():
+        rc = RCHelper.default()
+        return lambda: RCHelper.write_binary(rc)
+
+    yield "write_binary", write_binary
+
+    def export(full):
+        def factory():
+            overrides = style_overrides("ggplot")
+            return lambda: export_style(overrides, "mplstyle", full)
+
+        return factory
+
+    yield "export_style[overrides]", export(False)
+    yield "export_style[full]", export(True)
+
+    yield "compile_schema", lambda: compile_schema
+    yield "compile_catalog", lambda: compile_catalog
+
+    def load_schema_from_disk():
+        load_schema()  # Make sure the disk cache exists
+        return load_schema.__wrapped__
+
+    yield "load_schema[disk]", load_schema_from_disk
+
+    def sync_overrides():
+        table = {
+            "axes.grid": "True",
+            "lines.linewidth": "3",
+            "axes.facecolor": "#eeeeee",
+            "font.size": "12",
+        }
+        edited = dict(table, **{"font.size": "14"})
+        overrides = RCOverrides()
+
+        def run():
+            # A rerun after editing a key of the table, and one reverting it
+            overrides.sync(edited)
+            overrides.sync(table)
+
+        return run
+
+    yield "sync_overrides[4 edits]", sync_overrides
+
+    def history_edits():
+        keys = [k for k in RCHelper.sorted_keys() if "linewidth" in k]
+
+        def run():
+            # Snapshots of an edit per key, all undone and redone
+            overrides = RCOverrides()
+            history = EditHistory(overrides.params)
+            for i, key in enumerate(keys):
+                overrides.set(key, str(i % 5 + 1))
+                history.record(overrides.params)
+            while history.can_undo:
+                history.undo()
+            while history.can_redo:
+                history.redo()
+
+        return run
+
+    yield "edit_history[linewidth keys]", history_edits
+
+    def key_suggestions():
+        typos = ["axes.titel", "lines.linewdth", "xtick.major.sze", "figsize"]
+        key_index()  # Built once per process
+
+        def run():
+            for typo in typos:
+                key_index().search(typo, 1)
+
+        return run
+
+    yield "key_index.search[4 typos]", key_suggestions
+
+    def startup_process():
+        # A new process, importing the app modules and warming their caches
+        command = [sys.executable, str(ROOT / "startup.py")]
+        return lambda: subprocess.run(command, check=True, capture_output=True)
+
+    yield "startup[new process]", startup_process
+
+    def app_rerun():
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(str(APP), default_timeout=120)
+        at.run()
+        return at.run
+
+    yield "app_rerun", app_rerun
+
+
+def compare(
+    results: dict[str, Timing], baseline: dict[str, Timing], threshold: float
+) -> list[str]:
+    """Names of the benchmarks slower than `baseline` by more than `threshold`."""
+    return [
+        name
+        for name, timing in results.items()
+        if name in baseline
+        and timing["median"] > baseline[name]["median"] * (1 + threshold)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("-o", "--output", help="save results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown of the median reported as a regression",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument(
+        "-k", "--filter", default="", help="only run benchmarks containing this"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="run fewer styles and sizes"
+    )
+    args = parser.parse_args(argv)
+
+    baseline: Optional[dict[str, Timing]] = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+
+    results: dict[str, Timing] = {}
+    for name, factory in cases(args.quick):
+        if args.filter not in name:
+            continue
+        func = factory()
+        func()  # Warm up
+        results[name] = timing = measure(func, args.repeat)
+        line = f"{name:<50} {1000 * timing['median']:10.2f} ms"
+        if baseline is not None and name in baseline:
+            ratio = timing["median"] / baseline[name]["median"]
+            line += f" {ratio:8.2f}x"
+        print(line, flush=True)
+
+    if args.output:
+        report = dict(
+            meta=dict(
+                date=datetime.now(timezone.utc).isoformat(),
+                python=platform.python_version(),
+                matplotlib=mpl.__version__,
+                streamlit=importlib.metadata.version("streamlit"),
+                machine=platform.machine(),
+            ),
+            results=results,
+        )
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print(f"Regression: {name}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+"""
+Catalog of the installed fonts, by family, for the `font.*` rcParams.
+
+The catalog lists the faces of each family known to matplotlib's font
+manager, with the file `findfont` resolves the family to. It is built once
+per set of installed fonts and cached on disk, like the rcParam schema.
+"""
+
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, Mapping, TypedDict
+
+import matplotlib as mpl
+from matplotlib import font_manager
+
+import settings
+from helper import load_json_cache
+
+# Bump when the compiled catalog changes, to invalidate the disk caches
+CATALOG_VERSION = 1
+
+# rcParams listing font families, and the generic families `font.family` takes
+FAMILY_KEYS = (
+    "font.cursive",
+    "font.family",
+    "font.fantasy",
+    "font.monospace",
+    "font.sans-serif",
+    "font.serif",
+)
+GENERIC_FAMILIES = ("cursive", "fantasy", "monospace", "sans-serif", "serif")
+
+# Names of the numeric weights of the font manager, the first one of each
+_WEIGHT_NAMES: dict[int, str] = {}
+for _name, _weight in font_manager.weight_dict.items():
+    _WEIGHT_NAMES.setdefault(_weight, _name)
+
+
+class FontFace(TypedDict):
+    fname: str
+    style: str
+    variant: str
+    weight: int
+    stretch: str
+
+
+class FontFamily(TypedDict):
+    faces: list[FontFace]
+    regular: str  # File of the family at normal style and weight
+
+
+def compile_catalog() -> dict[str, FontFamily]:
+    faces: dict[str, list[FontFace]] = {}
+    for entry in font_manager.fontManager.ttflist:
+        faces.setdefault(entry.name, []).append(
+            FontFace(
+                fname=entry.fname,
+                style=entry.style,
+                variant=entry.variant,
+                weight=int(font_manager.weight_dict.get(entry.weight, entry.weight)),
+                stretch=str(entry.stretch),
+            )
+        )
+    catalog = {}
+    for name in sorted(faces, key=str.lower):
+        regular = font_manager.findfont(
+            font_manager.FontProperties(family=name), fallback_to_default=False
+        )
+        catalog[name] = FontFamily(
+            faces=sorted(faces[name], key=lambda f: (f["weight"], f["style"])),
+            regular=regular,
+        )
+    return catalog
+
+
+def cache_path(cache_dir: str) -> Path:
+    # Installing or removing fonts changes the list of files
+    files = sorted(entry.fname for entry in font_manager.fontManager.ttflist)
+    digest = hashlib.sha256("\n".join(files).encode("utf8")).hexdigest()[:16]
+    name = f"font_catalog-mpl{mpl.__version__}-v{CATALOG_VERSION}-{digest}.json"
+    return Path(cache_dir) / name
+
+
+@lru_cache(maxsize=None)
+def load_catalog(cache_dir: str = settings.CACHE_DIR) -> dict[str, FontFamily]:
+    """Catalog from the disk cache, compiled and cached if missing."""
+    return load_json_cache(cache_path(cache_dir), compile_catalog)
+
+
+@lru_cache(maxsize=None)
+def family_options() -> dict[str, list[str]]:
+    """Families offered by each rcParam listing font families."""
+    families = list(load_catalog())
+    return {
+        key: list(GENERIC_FAMILIES) + families if key == "font.family" else families
+        for key in FAMILY_KEYS
+    }
+
+
+def font_label(family: str) -> str:
+    """`family` with its weights and styles, or why it has none."""
+    if family in GENERIC_FAMILIES:
+        return f"{family} (generic)"
+    entry = load_catalog().get(family)
+    if entry is None:
+        return f"{family} (not installed)"
+    weights = [
+        _WEIGHT_NAMES.get(w, str(w))
+        for w in sorted({f["weight"] for f in entry["faces"]})
+    ]
+    styles = sorted({f["style"] for f in entry["faces"]})
+    return f"{family} · {', '.join(weights)} · {', '.join(styles)}"
+
+
+def missing_families(families: Iterable[str]) -> list[str]:
+    """Families neither installed nor generic, which matplotlib falls back from."""
+    catalog = load_catalog()
+    return [f for f in families if f not in catalog and f not in GENERIC_FAMILIES]
+
+
+def preload_fonts(overrides: Mapping[str, Any]) -> int:
+    """
+    Resolve and open the regular face of the installed families listed in
+    the `font.*` rcParams of `overrides`, before rendering them. Returns the
+    number of families loaded.
+    """
+    catalog = load_catalog()
+    families = set()
+    for key in FAMILY_KEYS:
+        names = overrides.get(key, ())
+        families.update([names] if isinstance(names, str) else names)
+    families.intersection_update(catalog)
+    for name in families:
+        font_manager.findfont(font_manager.FontProperties(family=name))
+        font_manager.get_font(catalog[name]["regular"])
+    return len(families)
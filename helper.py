@@ -1,10 +1,17 @@
+import json
+import os
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional, TypedDict
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Optional, TypedDict
 
-import matplotlib.pyplot as plt
 import pandas as pd
-from matplotlib import RcParams, rcParamsDefault
+from matplotlib import RcParams, colormaps
 from matplotlib import colors as mcolors
+from matplotlib import rcParamsDefault
+
+from history import PersistentMap
 
 
 class InputsDict(TypedDict):
@@ -16,6 +23,50 @@ class InputsDict(TypedDict):
 COLORS = sorted(mcolors.get_named_colors_mapping().keys()) + ["none"]
 
 
+def load_json_cache(path: Path, compile: Callable[[], Any]) -> Any:
+    """Contents of the JSON file `path`, compiled and written to it if missing."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        pass
+    value = compile()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write atomically, other processes may be loading it
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(value))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return value
+
+
+@lru_cache(maxsize=None)
+def option_index(options: tuple) -> dict:
+    """Index of the first occurrence of each option in `options`."""
+    index: dict = {}
+    for i, option in enumerate(options):
+        index.setdefault(option, i)
+    return index
+
+
+@lru_cache(maxsize=None)
+def color_options(extra: Optional[str] = None) -> tuple[list[str], dict[str, int]]:
+    """Color names, with `extra` if given, and their index by name and hex."""
+    colors = COLORS + ([extra] if extra else [])
+    index = dict(option_index(tuple(colors)))  # Copy, not to alter the cache
+    for i, name in enumerate(colors):
+        if name != extra:
+            index.setdefault(mcolors.to_hex(name, keep_alpha=True), i)
+    return colors, index
+
+
+@lru_cache(maxsize=None)
+def colormap_options() -> tuple[list[str], dict[str, int]]:
+    cmaps = sorted(colormaps)
+    return cmaps, dict(option_index(tuple(cmaps)))
+
+
 class DFHelper:
     def __init__(self) -> None:
         pass
@@ -31,12 +82,32 @@ class DFHelper:
     def insert(df: pd.DataFrame, key, val):
         df.loc[key] = val
 
+    @staticmethod
+    def update(df: pd.DataFrame, values: Mapping[str, Any]) -> pd.DataFrame:
+        """`df` with the rows of `values` added or replaced, in one copy."""
+        rows = pd.DataFrame(
+            dict(rcParam=list(values), Value=[str(v) for v in values.values()])
+        ).set_index("rcParam")
+        return pd.concat([df.drop(rows.index, errors="ignore"), rows])
+
 
 class RCHelper:
     @staticmethod
     def default() -> RcParams:
         return rcParamsDefault.copy()
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def defaults() -> Mapping[str, Any]:
+        """Read-only default rcParams, shared by the whole process."""
+        return MappingProxyType(dict(rcParamsDefault))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def sorted_keys() -> tuple[str, ...]:
+        """Sorted editable keys of the default rcParams, shared by the whole process."""
+        return tuple(RCHelper.get_sorted_keys(rcParamsDefault))
+
     @staticmethod
     def get_sorted_keys(rc: RcParams) -> list[str]:
         return sorted(
@@ -55,8 +126,18 @@ class RCHelper:
     def insert(rc: RcParams, key, val):
         rc[key] = val
 
+    @staticmethod
+    def diff(rc: RcParams, base: Optional[RcParams] = None) -> dict:
+        """Keys of `rc` whose values differ from `base` (default rcParams)."""
+        if base is None:
+            base = rcParamsDefault
+        return {k: v for k, v in rc.items() if k not in base or base[k] != v}
+
     @staticmethod
     def fix_string(key, val):
+        if isinstance(val, list):
+            # Font families chosen in a multiselect, none means no value
+            return ", ".join(val) or None
         if (
             key is not None
             and val is not None
@@ -70,12 +151,23 @@ class RCHelper:
             val = val.replace("[", "").replace("]", "")
         return val
 
+    @staticmethod
+    def is_color(key: str) -> bool:
+        return (
+            "color" in key
+            and "patch.force_edgecolor" not in key
+            and "pcolor" not in key
+            and "pdf.inheritcolor" not in key
+        )
+
     @staticmethod
     def get_input_widget_description(
         key: str,
         rc: Optional[RcParams] = None,
         select_options: Optional[dict[str, list]] = None,
         widget_is_picker: bool = True,
+        font_options: Optional[dict[str, list]] = None,
+        font_label: Optional[Callable[[str], str]] = None,
     ) -> InputsDict:
         if rc is None:
             rc = rcParamsDefault
@@ -87,19 +179,26 @@ class RCHelper:
         if select_options is not None and key in select_options.keys():
             widget = "selectbox"
             args = ("Value" if key is None else key, select_options[key])
-            if val in select_options[key]:
-                index = select_options[key].index(val)
-            elif str(val) in select_options[key]:
-                index = select_options[key].index(str(val))
-            else:
-                index = 0
+            options_index = option_index(tuple(select_options[key]))
+            index = options_index.get(val, options_index.get(str(val), 0))
             kwargs = dict(label_visibility="collapsed", index=index, key=key)
+        elif font_options is not None and key in font_options:
+            # Families of the value which are not installed are offered too
+            options = font_options[key]
+            known = option_index(tuple(options))
+            widget = "multiselect"
+            args = (key, options + [f for f in val if f not in known])
+            kwargs = dict(default=list(val), label_visibility="collapsed", key=key)
+            if font_label is not None:
+                kwargs["format_func"] = font_label
         elif "cmap" in key:
-            index = COLORS.index(key) if key in plt.colormaps() else None
+            cmaps, cmap_index = colormap_options()
             widget = "selectbox"
-            args = ("Select a colormap", plt.colormaps())
-            kwargs = dict(index=index, label_visibility="collapsed", key=key)
-        elif "linewidth" in key:
+            args = ("Select a colormap", cmaps)
+            kwargs = dict(
+                index=cmap_index.get(val), label_visibility="collapsed", key=key
+            )
+        elif "linewidth" in key and val is not None:
             widget = "slider"
             args = ("Value" if key is None else key,)
             kwargs = dict(
@@ -109,7 +208,7 @@ class RCHelper:
                 label_visibility="collapsed",
                 key=key,
             )
-        elif "alpha" in key:
+        elif "alpha" in key and val is not None:
             widget = "slider"
             args = ("Value" if key is None else key,)
             kwargs = dict(
@@ -119,25 +218,23 @@ class RCHelper:
                 label_visibility="collapsed",
                 key=key,
             )
-        elif (
-            "color" in key
-            and "patch.force_edgecolor" not in key
-            and "pcolor" not in key
-            and "pdf.inheritcolor" not in key
-        ):
+        elif RCHelper.is_color(key):
+            # Values such as "auto" or "inherit" are offered besides colors
+            is_color = val is not None and mcolors.is_color_like(val)
+            extra = None if is_color or val is None else str(val)
             if widget_is_picker:
-                color_hex = "none" if val is None else mcolors.to_hex(val)
+                color_hex = mcolors.to_hex(val) if is_color else "#000000"
                 widget = "color_picker"
                 args = ("Pick a color",)
                 kwargs = dict(value=color_hex, label_visibility="collapsed", key=key)
             else:
                 widget = "selectbox"
-                colors = COLORS
-                if key == "axes.titlecolor":
-                    colors += ["auto"]
-                elif key == "legend.facecolor":
-                    colors += ["inherit"]
-                index = colors.index(key) if key in colors else colors.index("none")
+                colors, color_index = color_options(extra)
+                index = color_index.get(val)
+                if index is None and is_color:
+                    index = color_index.get(mcolors.to_hex(val, keep_alpha=True))
+                if index is None:
+                    index = color_index["none"]
                 args = ("Select a color", colors)
                 kwargs = dict(index=index, label_visibility="collapsed", key=key)
         elif isinstance(val, bool):
@@ -158,3 +255,86 @@ class RCHelper:
             w = RCHelper.fix_string(k, f"{k}: {v}\n")
             out.write(w.encode("utf8"))
         return out
+
+
+class RCOverrides:
+    """
+    rcParams set by the user, on top of the default rcParams.
+
+    Only the keys that were set are stored and validated, so syncing with
+    the table of edits costs in the number of edits, not in the number of
+    rcParams. Both values of each key are also kept in `params`, a snapshot
+    for the edit history which is replaced when a value changes.
+    """
+
+    def __init__(self) -> None:
+        # Validated values, and values as they were entered
+        self.values: dict[str, Any] = {}
+        self.raw: dict[str, Any] = {}
+        self.params = PersistentMap()
+
+    @classmethod
+    def from_params(cls, params: PersistentMap) -> "RCOverrides":
+        """Overrides of a snapshot of `params`, sorted by key."""
+        overrides = cls()
+        overrides.params = params
+        for key in sorted(params):
+            overrides.values[key], overrides.raw[key] = params[key]
+        return overrides
+
+    @staticmethod
+    def validate(key: str, val):
+        return RcParams.validate[key](val)
+
+    def _snapshot(self, key: str, val, raw) -> None:
+        # Entering a value differently, e.g. "1" for 1.0, is not an edit
+        if key not in self.values or self.values[key] != val:
+            self.params = self.params.set(key, (val, raw))
+
+    def set(self, key: str, val) -> None:
+        validated = self.validate(key, val)
+        self._snapshot(key, validated, val)
+        self.values[key] = validated
+        self.raw[key] = val
+
+    def update(self, values: Mapping[str, Any], raw: Mapping[str, Any]) -> None:
+        """Set already validated `values`, entered as `raw`."""
+        for key, val in values.items():
+            self._snapshot(key, val, raw.get(key, val))
+        self.values.update(values)
+        self.raw.update(raw)
+
+    def remove(self, key: str) -> None:
+        self.params = self.params.remove(key)
+        self.values.pop(key, None)
+        self.raw.pop(key, None)
+
+    def sync(self, table: Mapping[str, Any]) -> dict[str, str]:
+        """
+        Apply the keys added, changed or removed in `table` since last time.
+
+        Keys of `table` with a `None` value are removed. Unknown keys are
+        ignored. Returns the validation errors by key, those keys are
+        removed as well.
+        """
+        for key in list(self.raw):
+            if table.get(key) is None:
+                self.remove(key)
+        errors = {}
+        for key, val in table.items():
+            if val is None or key not in RCHelper.defaults():
+                continue
+            if key in self.raw and self.raw[key] == val:
+                continue
+            try:
+                self.set(key, val)
+            except ValueError as e:
+                self.remove(key)
+                errors[key] = str(e)
+        return errors
+
+    def diff(self, base: Optional[Mapping[str, Any]] = None) -> dict:
+        """Overrides whose values differ from `base` (default rcParams)."""
+        if base is None:
+            base = RCHelper.defaults()
+        return {k: v for k, v in self.values.items() if base[k] != v}
@@ -0,0 +1,207 @@
+"""
+History of the edits of a session, to undo and redo them.
+
+Each edit of the overrides is a snapshot, a `PersistentMap` of the rcParams
+set. Snapshots share the entries they have in common, so one costs memory in
+the keys it changed, not in the number of overrides. Snapshots keep the key
+of the preview rendered for them, and the most recent ones its image too, to
+show it again without rendering when they are restored.
+"""
+
+from collections import OrderedDict, deque
+from typing import Any, Iterator, Mapping, Optional, TypedDict
+
+import settings
+
+# Bits of the hash of a key consumed by each level of the trie
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+# Levels of the trie, keys whose hashes collide on all of them share a bucket
+_MAX_DEPTH = 64 // _BITS
+# Entries of a bucket before it is split into a branch
+_BUCKET_SIZE = 8
+
+_MISSING = object()
+
+
+def _hash(key: Any) -> int:
+    return hash(key) & 0xFFFFFFFFFFFFFFFF
+
+
+def _set(node, h: int, key: Any, value: Any, depth: int):
+    # Nodes are buckets (dicts, never modified) or branches (tuples of nodes)
+    if node is None:
+        return {key: value}
+    if isinstance(node, dict):
+        if len(node) < _BUCKET_SIZE or key in node or depth >= _MAX_DEPTH:
+            return {**node, key: value}
+        branch: tuple = (None,) * _WIDTH
+        for k, v in node.items():
+            branch = _set(branch, _hash(k), k, v, depth)
+        node = branch
+    i = (h >> (_BITS * depth)) & _MASK
+    children = list(node)
+    children[i] = _set(node[i], h, key, value, depth + 1)
+    return tuple(children)
+
+
+def _remove(node, h: int, key: Any, depth: int):
+    if isinstance(node, dict):
+        return {k: v for k, v in node.items() if k != key} or None
+    i = (h >> (_BITS * depth)) & _MASK
+    children = list(node)
+    children[i] = _remove(node[i], h, key, depth + 1)
+    return tuple(children) if any(children) else None
+
+
+def _items(node) -> Iterator[tuple[Any, Any]]:
+    if isinstance(node, dict):
+        yield from node.items()
+    elif node is not None:
+        for child in node:
+            yield from _items(child)
+
+
+class PersistentMap(Mapping[str, Any]):
+    """
+    Immutable mapping, sharing its entries with the mappings derived from it.
+
+    Entries are stored in a trie on the hash of their keys. `set` and
+    `remove` return a new mapping, copying only the nodes on the path of the
+    key, and the mapping itself when nothing changed.
+    """
+
+    __slots__ = ("_root", "_len")
+
+    def __init__(self) -> None:
+        self._root = None
+        self._len = 0
+
+    def _derive(self, root, length: int) -> "PersistentMap":
+        derived = PersistentMap()
+        derived._root, derived._len = root, length
+        return derived
+
+    def _lookup(self, key: Any) -> Any:
+        node, h, depth = self._root, _hash(key), 0
+        while node is not None and not isinstance(node, dict):
+            node = node[(h >> (_BITS * depth)) & _MASK]
+            depth += 1
+        return _MISSING if node is None else node.get(key, _MISSING)
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __iter__(self) -> Iterator[Any]:
+        return (k for k, _ in _items(self._root))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def set(self, key: Any, value: Any) -> "PersistentMap":
+        old = self._lookup(key)
+        if old is not _MISSING and (old is value or old == value):
+            return self
+        root = _set(self._root, _hash(key), key, value, 0)
+        return self._derive(root, self._len + (old is _MISSING))
+
+    def remove(self, key: Any) -> "PersistentMap":
+        if key not in self:
+            return self
+        return self._derive(_remove(self._root, _hash(key), key, 0), self._len - 1)
+
+
+class Snapshot(TypedDict):
+    params: PersistentMap  # Validated and entered values of the overrides, by key
+    preview_key: Optional[str]  # Render cache key of the preview, once rendered
+    preview: Optional[bytes]  # The preview, while within the byte budget
+
+
+class EditHistory:
+    """
+    Snapshots of the overrides of a session, the `current` one and those to
+    undo and redo, up to `max_size` edits back.
+
+    Undoing and redoing move a snapshot between two stacks, recording an
+    edit drops the snapshots to redo. The previews of the snapshots linked
+    last are kept, up to `preview_bytes` in total, and the keys of all.
+    """
+
+    def __init__(
+        self,
+        params: Optional[PersistentMap] = None,
+        max_size: int = settings.HISTORY_SIZE,
+        preview_bytes: int = settings.HISTORY_PREVIEW_BYTES,
+    ) -> None:
+        self.current = self._snapshot(PersistentMap() if params is None else params)
+        self.preview_bytes = preview_bytes
+        self._undo: deque[Snapshot] = deque(maxlen=max_size)
+        self._redo: list[Snapshot] = []
+        # Snapshots keeping their preview by id, linked last at the end
+        self._previews: OrderedDict[int, Snapshot] = OrderedDict()
+        self._nbytes = 0
+
+    @staticmethod
+    def _snapshot(params: PersistentMap) -> Snapshot:
+        return Snapshot(params=params, preview_key=None, preview=None)
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def record(self, params: PersistentMap) -> bool:
+        """Snapshot `params`, unless they are those of the current snapshot."""
+        if params is self.current["params"]:
+            return False
+        # Snapshots dropped from the history release their previews
+        if len(self._undo) == self._undo.maxlen:
+            self._drop_preview(self._undo[0])
+        for snapshot in self._redo:
+            self._drop_preview(snapshot)
+        self._undo.append(self.current)
+        self.current = self._snapshot(params)
+        self._redo = []
+        return True
+
+    def undo(self) -> Snapshot:
+        self._redo.append(self.current)
+        self.current = self._undo.pop()
+        return self.current
+
+    def redo(self) -> Snapshot:
+        self._undo.append(self.current)
+        self.current = self._redo.pop()
+        return self.current
+
+    def _drop_preview(self, snapshot: Snapshot) -> None:
+        if self._previews.pop(id(snapshot), None) is not None:
+            assert snapshot["preview"] is not None
+            self._nbytes -= len(snapshot["preview"])
+            snapshot["preview"] = None
+
+    def link(self, key: str, image: bytes) -> None:
+        """Link `image`, rendered under `key`, as the preview of the current snapshot."""
+        snapshot = self.current
+        self._drop_preview(snapshot)
+        snapshot["preview_key"], snapshot["preview"] = key, image
+        self._previews[id(snapshot)] = snapshot
+        self._nbytes += len(image)
+        while self._nbytes > self.preview_bytes:
+            self._drop_preview(next(iter(self._previews.values())))
+
+    def preview(self, key: str) -> Optional[bytes]:
+        """Preview of the current snapshot, if it was rendered under `key`."""
+        if self.current["preview_key"] != key:
+            return None
+        return self.current["preview"]
@@ -0,0 +1,84 @@
+import json
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+from typing import Any, ContextManager, Optional
+
+import pandas as pd
+
+_log_lock = Lock()
+_disabled = nullcontext()
+
+
+class RerunTimer:
+    """
+    Times named stages (spans) of a rerun of the app.
+
+    When disabled, `span` returns a shared no-op context manager and nothing
+    is recorded, so instrumented code costs next to nothing.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.spans: dict[str, float] = {}
+        self.info: dict[str, Any] = {}
+        self._start = time.perf_counter()
+
+    def span(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return _disabled
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self) -> float:
+        return time.perf_counter() - self._start
+
+    def record(self, session_id: str, path: Optional[str]) -> None:
+        """Append the rerun as a JSON line to `path`, if any."""
+        if not self.enabled or not path:
+            return
+        line = json.dumps(
+            dict(
+                time=time.time(),
+                session_id=session_id,
+                total_ms=1000 * self.total(),
+                spans_ms={k: 1000 * v for k, v in self.spans.items()},
+                **self.info,
+            )
+        )
+        with _log_lock, open(path, "a") as f:
+            f.write(line + "\n")
+
+
+def deep_sizeof(obj: Any, seen: Optional[set[int]] = None) -> int:
+    """Approximate memory used by `obj` and the objects it refers to."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    else:
+        if hasattr(obj, "__dict__"):
+            size += deep_sizeof(vars(obj), seen)
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            for name in [slots] if isinstance(slots, str) else slots:
+                if name not in ("__dict__", "__weakref__"):
+                    size += deep_sizeof(getattr(obj, name, None), seen)
+    return size
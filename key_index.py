@@ -0,0 +1,68 @@
+"""Fuzzy search over rcParam keys, through an index of their n-grams."""
+
+import heapq
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Sequence
+
+from helper import RCHelper
+
+
+def ngrams(text: str, n: int = 3) -> set[str]:
+    text = f" {text.lower()} "
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class KeyIndex:
+    """
+    Index of the n-grams and group prefixes (e.g. `axes.`, `xtick.major.`)
+    of a list of keys.
+
+    Keys are ranked by the Dice coefficient of their n-grams with the query,
+    with a bonus for keys in the same group as the query, and a larger one
+    for keys starting with the query.
+    """
+
+    def __init__(self, keys: Sequence[str], n: int = 3) -> None:
+        self.keys = list(keys)
+        self.n = n
+        self._postings: dict[str, list[int]] = defaultdict(list)
+        self._sizes: list[int] = []
+        self._groups: dict[str, list[int]] = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            grams = ngrams(key, n)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+            parts = key.split(".")
+            for j in range(1, len(parts)):
+                self._groups[".".join(parts[:j]) + "."].append(i)
+
+    def search(self, query: str, limit: int = 10) -> list[str]:
+        grams = ngrams(query, self.n)
+        counts: Counter = Counter()
+        for gram in grams:
+            counts.update(self._postings.get(gram, ()))
+        scores = {
+            i: 2 * count / (len(grams) + self._sizes[i]) for i, count in counts.items()
+        }
+        lowered = query.lower()
+        group = lowered[: lowered.rfind(".") + 1]
+        for i in self._groups.get(group, ()) if group else ():
+            scores[i] = scores.get(i, 0.0) + 0.2
+        for i in scores:
+            if self.keys[i].startswith(lowered):
+                scores[i] += 1.0
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [self.keys[i] for i, _ in best]
+
+
+@lru_cache(maxsize=None)
+def key_index() -> KeyIndex:
+    return KeyIndex(RCHelper.sorted_keys())
+
+
+@lru_cache(maxsize=4096)
+def suggest(key: str, limit: int = 1) -> tuple[str, ...]:
+    """Keys closest to an unknown `key`, cached per key."""
+    return tuple(key_index().search(key, limit))
@@ -0,0 +1,551 @@
+"""
+Load test of the app, with simulated sessions editing styles concurrently.
+
+    python load_test.py --sessions 8 --duration 60 -o load.json
+    python load_test.py --sessions 8 --duration 60 --compare load.json
+
+A server is started locally and each session connects to it as a browser
+does, over its websocket, replaying a script of edits: selecting an rcParam,
+setting and persisting its value, editing the table and downloading the
+style. The preview is polled as the browser does until it lands. Reruns are
+timed from sending the widget states to the end of the script, and the
+resident memory of the server and its render workers is sampled meanwhile.
+
+Reports are saved as JSON. With `--compare`, steps whose p95 latency, or the
+peak memory, grew by more than `--threshold` relative to the baseline are
+reported as regressions and the command exits non-zero.
+"""
+
+import argparse
+import asyncio
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional, TypedDict
+
+import matplotlib as mpl
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.websocket import WebSocketClientConnection, websocket_connect
+
+ROOT = Path(__file__).resolve().parent
+APP = ROOT / "streamlit-matplotlib-style-app.py"
+
+# rcParams edited with their widget, and the values set on alternate rounds
+EDITS = [
+    ("axes.grid", (True, False)),
+    ("lines.linewidth", (3.0, 1.0)),
+    ("font.size", ("14", "8")),
+    ("axes.facecolor", ("lightgray", "ivory")),
+    ("axes.titlesize", ("x-large", "small")),
+]
+# Rows added in the table
+TABLE_EDITS = [
+    ("lines.markersize", "9"),
+    ("axes.linewidth", "2"),
+    ("figure.facecolor", "ivory"),
+]
+# Script runs that end an interaction, unlike those interrupted by a rerun
+FINISHED = (
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+)
+# Steps which are not a single rerun
+NOT_RERUNS = ("preview", "download")
+
+
+class Latency(TypedDict):
+    count: int
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+class MemorySample(TypedDict):
+    time: float
+    server: int  # Resident bytes
+    workers: int
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def child_pids(pid: int) -> list[int]:
+    """Processes started by `pid`, and those they started."""
+    parents: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The name of the command is in parentheses, maybe with spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    children, todo = [], [pid]
+    while todo:
+        for child in parents.get(todo.pop(), ()):
+            children.append(child)
+            todo.append(child)
+    return children
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def latency(values: list[float]) -> Latency:
+    values = sorted(values)
+    return Latency(
+        count=len(values),
+        p50=percentile(values, 50),
+        p95=percentile(values, 95),
+        p99=percentile(values, 99),
+        max=values[-1],
+    )
+
+
+class Recorder:
+    """Timings of the steps of every session, since the start of the test."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.steps: list[tuple[float, str, float]] = []  # (time, step, seconds)
+        self.errors: list[str] = []
+        self.memory: list[MemorySample] = []
+
+    def now(self) -> float:
+        return time.perf_counter() - self.start
+
+    def add(self, step: str, seconds: float) -> None:
+        self.steps.append((self.now(), step, seconds))
+
+    def latencies(self) -> dict[str, Latency]:
+        by_step: dict[str, list[float]] = {}
+        for _, step, seconds in self.steps:
+            by_step.setdefault(step, []).append(seconds)
+            if step not in NOT_RERUNS:
+                by_step.setdefault("rerun", []).append(seconds)
+        return {step: latency(values) for step, values in sorted(by_step.items())}
+
+    def reruns(self) -> int:
+        return sum(step not in NOT_RERUNS for _, step, _ in self.steps)
+
+
+def widget_state(element_type: str, widget_id: str, value: Any) -> WidgetState:
+    """State of a widget set to `value`, as sent by the browser."""
+    state = WidgetState(id=widget_id)
+    if element_type == "button":
+        state.trigger_value = True
+    elif element_type == "checkbox":
+        state.bool_value = value
+    elif element_type == "slider":
+        state.double_array_value.data[:] = [value]
+    elif element_type == "arrow_data_frame":
+        state.string_value = json.dumps(value)
+    else:
+        state.string_value = value
+    return state
+
+
+class Session:
+    """A browser session of the app, driven through its websocket."""
+
+    def __init__(self, url: str, recorder: Recorder, timeout: float) -> None:
+        self.url = url
+        self.recorder = recorder
+        self.timeout = timeout
+        self.ws: Optional[WebSocketClientConnection] = None
+        self.session_id = ""
+        self.query_string = ""
+        self.widgets: dict[str, tuple[str, Any]] = {}  # id: (type, proto)
+        self.states: dict[str, WidgetState] = {}
+        self.fragments: dict[str, float] = {}  # Polled fragment: interval
+        self.files: dict[str, Any] = {}  # Deferred file responses by id
+
+    async def connect(self) -> None:
+        request = HTTPRequest(
+            f"ws://{self.url}/_stcore/stream",
+            headers={"Sec-WebSocket-Protocol": "streamlit"},
+        )
+        self.ws = await websocket_connect(request)
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            self.ws.close()
+
+    async def _send(self, msg: BackMsg) -> None:
+        assert self.ws is not None
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+
+    async def _receive(self) -> ForwardMsg:
+        assert self.ws is not None
+        data = await asyncio.wait_for(self.ws.read_message(), self.timeout)
+        if data is None:
+            raise ConnectionError("The server closed the connection")
+        msg = ForwardMsg()
+        msg.ParseFromString(data)
+        kind = msg.WhichOneof("type")
+        if kind == "new_session":
+            self.session_id = msg.new_session.initialize.session_id
+            if not msg.new_session.fragment_ids_this_run:
+                # Fragments polled by a full run are registered again
+                self.fragments.clear()
+        elif kind == "auto_rerun":
+            self.fragments[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+        elif kind == "page_info_changed":
+            self.query_string = msg.page_info_changed.query_string
+        elif kind == "deferred_file_response":
+            self.files[msg.deferred_file_response.file_id] = msg.deferred_file_response
+        elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            element_type = msg.delta.new_element.WhichOneof("type")
+            element = getattr(msg.delta.new_element, element_type)
+            if element_type == "exception":
+                self.recorder.errors.append(element.message)
+            elif getattr(element, "id", ""):
+                self.widgets[element.id] = (element_type, element)
+        return msg
+
+    async def rerun(self, step: str, fragment_id: str = "") -> None:
+        """Send the widget states and wait for the script to finish."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+            msg.rerun_script.is_auto_rerun = True
+        # Buttons are only pressed for one rerun
+        self.states = {
+            k: s for k, s in self.states.items() if not s.HasField("trigger_value")
+        }
+        start = time.perf_counter()
+        await self._send(msg)
+        while True:
+            reply = await self._receive()
+            if reply.WhichOneof("type") == "script_finished":
+                if reply.script_finished in FINISHED:
+                    break
+        self.recorder.add(step, time.perf_counter() - start)
+
+    def find(self, label: str = "", key: str = "") -> tuple[str, Any]:
+        for element_type, element in self.widgets.values():
+            if (key and element.id.endswith(f"-{key}")) or (
+                label and getattr(element, "label", None) == label
+            ):
+                return element_type, element
+        raise LookupError(f"No widget {label or key!r}")
+
+    async def set(self, step: str, value: Any, label: str = "", key: str = "") -> None:
+        element_type, element = self.find(label, key)
+        self.states[element.id] = widget_state(element_type, element.id, value)
+        await self.rerun(step)
+
+    async def wait_preview(self, start: float) -> None:
+        """Poll the preview as the browser does, until it stops polling."""
+        while self.fragments:
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError("The preview did not land")
+            fragment_id, interval = next(iter(self.fragments.items()))
+            await asyncio.sleep(interval)
+            await self.rerun("poll", fragment_id)
+        self.recorder.add("preview", time.perf_counter() - start)
+
+    async def download(self) -> None:
+        _, button = self.find("Download")
+        start = time.perf_counter()
+        msg = BackMsg()
+        msg.deferred_file_request.file_id = button.deferred_file_id
+        msg.deferred_file_request.session_id = self.session_id
+        await self._send(msg)
+        while button.deferred_file_id not in self.files:
+            await self._receive()
+        response = self.files.pop(button.deferred_file_id)
+        if response.error_msg:
+            raise RuntimeError(response.error_msg)
+        await AsyncHTTPClient().fetch(f"http://{self.url}{response.url}")
+        self.recorder.add("download", time.perf_counter() - start)
+
+
+async def run_session(
+    index: int, url: str, recorder: Recorder, until: float, think: float, timeout: float
+) -> None:
+    """Replay the script of edits in a new session, until `until`."""
+
+    async def pause():
+        await asyncio.sleep(random.uniform(0.5 * think, 1.5 * think))
+
+    session = Session(url, recorder, timeout)
+    await session.connect()
+    try:
+        await session.rerun("load")
+        await session.wait_preview(time.perf_counter())
+        round_no = index
+        while recorder.now() < until:
+            key, values = EDITS[round_no % len(EDITS)]
+            value = values[round_no // len(EDITS) % len(values)]
+            await pause()
+            await session.set("select", key, label="Edit an rcParam")
+            await pause()
+            start = time.perf_counter()
+            await session.set("edit", value, key=key)
+            await session.wait_preview(start)
+            await pause()
+            await session.set("persist", True, label="Persist change")
+            await pause()
+            row, row_value = TABLE_EDITS[round_no % len(TABLE_EDITS)]
+            edits = {
+                "edited_rows": {},
+                "added_rows": [{"_index": row, "Value": row_value}],
+                "deleted_rows": [],
+            }
+            start = time.perf_counter()
+            # The data editor is the only widget of its type
+            _, editor = next(
+                (t, e) for t, e in session.widgets.values() if t == "arrow_data_frame"
+            )
+            session.states[editor.id] = widget_state(
+                "arrow_data_frame", editor.id, edits
+            )
+            await session.rerun("data_editor")
+            await session.wait_preview(start)
+            await pause()
+            await session.download()
+            round_no += 1
+    except Exception as e:
+        recorder.errors.append(f"session {index}: {type(e).__name__}: {e}")
+    finally:
+        await session.close()
+
+
+async def sample_memory(recorder: Recorder, pid: int, interval: float) -> None:
+    while True:
+        recorder.memory.append(
+            MemorySample(
+                time=recorder.now(),
+                server=rss_bytes(pid),
+                workers=sum(rss_bytes(child) for child in child_pids(pid)),
+            )
+        )
+        await asyncio.sleep(interval)
+
+
+async def wait_healthy(url: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited")
+        try:
+            await AsyncHTTPClient().fetch(f"http://{url}/_stcore/health")
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise TimeoutError("The server did not start")
+
+
+async def load_test(
+    url: str,
+    server: subprocess.Popen,
+    sessions: int,
+    duration: float,
+    think: float,
+    ramp: float,
+    interval: float,
+    timeout: float,
+) -> Recorder:
+    await wait_healthy(url, server, timeout)
+    recorder = Recorder()
+    sampler = asyncio.create_task(sample_memory(recorder, server.pid, interval))
+
+    async def start(index):
+        await asyncio.sleep(ramp * index / sessions)
+        await run_session(index, url, recorder, duration, think, timeout)
+
+    try:
+        await asyncio.gather(*(start(i) for i in range(sessions)))
+    finally:
+        sampler.cancel()
+    return recorder
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Steps, or memory, worse than `baseline` by more than `threshold`."""
+    regressions = [
+        step
+        for step, timing in report["latency"].items()
+        if step in baseline["latency"]
+        and timing["p95"] > baseline["latency"][step]["p95"] * (1 + threshold)
+    ]
+    if report["peak_rss"] > baseline["peak_rss"] * (1 + threshold):
+        regressions.append("peak_rss")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("-o", "--output", help="save the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative growth of the p95 or peak memory reported as a regression",
+    )
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument(
+        "--duration", type=float, default=60, help="seconds of edits per test"
+    )
+    parser.add_argument(
+        "--think", type=float, default=1.0, help="mean seconds between user actions"
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=5, help="seconds over which sessions start"
+    )
+    parser.add_argument(
+        "--sample-interval", type=float, default=1, help="seconds between RSS samples"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="seconds to wait for a step"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the think times")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+
+    url = f"127.0.0.1:{free_port()}"
+    with tempfile.TemporaryDirectory() as tmp:
+        # The server settings are read from MPLSTYLER_* variables, the library
+        # of saved styles is a new one
+        env = dict(os.environ, MPLSTYLER_LIBRARY_PATH=f"{tmp}/library.sqlite3")
+        command = [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            str(APP),
+            "--server.headless=true",
+            f"--server.port={url.rsplit(':', 1)[1]}",
+            "--server.fileWatcherType=none",
+            "--browser.gatherUsageStats=false",
+        ]
+        with open(f"{tmp}/server.log", "w") as log:
+            server = subprocess.Popen(
+                command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+            try:
+                recorder = asyncio.run(
+                    load_test(
+                        url,
+                        server,
+                        args.sessions,
+                        args.duration,
+                        args.think,
+                        args.ramp,
+                        args.sample_interval,
+                        args.timeout,
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    elapsed = recorder.now()
+    report = dict(
+        meta=dict(
+            date=datetime.now(timezone.utc).isoformat(),
+            commit=git_commit(),
+            python=platform.python_version(),
+            matplotlib=mpl.__version__,
+            streamlit=importlib.metadata.version("streamlit"),
+            machine=platform.machine(),
+            cpus=os.cpu_count(),
+            settings={
+                k: v for k, v in os.environ.items() if k.startswith("MPLSTYLER_")
+            },
+            sessions=args.sessions,
+            duration=args.duration,
+            think=args.think,
+        ),
+        latency=recorder.latencies(),
+        throughput=recorder.reruns() / elapsed,
+        errors=recorder.errors,
+        peak_rss=max((m["server"] + m["workers"] for m in recorder.memory), default=0),
+        memory=recorder.memory,
+    )
+
+    print(f"{'step':<12} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for step, timing in report["latency"].items():
+        line = f"{step:<12} {timing['count']:6d}"
+        for q in ("p50", "p95", "p99", "max"):
+            line += f" {1000 * timing[q]:6.0f} ms"
+        if baseline is not None and step in baseline["latency"]:
+            line += f" {timing['p95'] / baseline['latency'][step]['p95']:6.2f}x"
+        print(line)
+    print(f"Throughput: {report['throughput']:.1f} reruns/s over {elapsed:.0f} s")
+    print(f"{'time':>6} {'server':>10} {'workers':>10}")
+    # Ten samples over the test
+    step = max(1, len(recorder.memory) // 10)
+    for m in recorder.memory[::step]:
+        print(
+            f"{m['time']:5.0f}s {m['server'] / 2**20:6.0f} MiB "
+            f"{m['workers'] / 2**20:6.0f} MiB"
+        )
+    print(f"Peak memory: {report['peak_rss'] / 2**20:.0f} MiB")
+    for error in report["errors"]:
+        print(f"Error: {error}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold)
+        for name in regressions:
+            print(f"Regression: {name}")
+        return 1 if regressions or report["errors"] else 0
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,209 @@
+"""
+Schema of the rcParams, derived from the validators of `matplotlib.rcsetup`.
+
+The schema describes the kind of value each key takes (enum options, numeric
+ranges, list lengths, colors, booleans...). It is compiled once per
+matplotlib version and cached on disk, so server restarts and worker
+processes load it instead of compiling it again.
+"""
+
+import inspect
+from enum import Enum
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, TypedDict
+
+import matplotlib as mpl
+import matplotlib.rcsetup as rcsetup
+from matplotlib import colormaps, markers
+from matplotlib.backend_bases import FigureCanvasBase
+
+import settings
+from helper import RCHelper, load_json_cache
+
+# Bump when the compiled schema changes, to invalidate the disk caches
+SCHEMA_VERSION = 1
+
+
+class ParamSchema(TypedDict):
+    kind: str  # bool, color, cmap, enum, float, int, list, str or other
+    options: Optional[list]  # Choices of enums, extra values of colors
+    min: Optional[float]
+    max: Optional[float]
+    length: Optional[int]  # Number of items of lists, if fixed
+
+
+def _manual_options() -> dict[str, list]:
+    options: dict[str, list] = {}
+    options["axes.autolimit_mode"] = ["data", "round_numbers"]
+    options["axes.axisbelow"] = [True, "line", False]
+    for key in ["axes.titlelocation", "xaxis.labellocation", "xtick.alignment"]:
+        options[key] = ["center", "left", "right"]
+    for key in ["yaxis.labellocation"]:
+        options[key] = ["bottom", "top", "center"]
+    for key in ["xtick.direction", "ytick.direction"]:
+        options[key] = ["in", "out", "inout"]
+    options["ytick.alignment"] = [
+        "bottom",
+        "baseline",
+        "center",
+        "center_baseline",
+        "top",
+    ]
+
+    options["font.stretch"] = [
+        "ultra-condensed",
+        "extra-condensed",
+        "condensed",
+        "semi-condensed",
+        "normal",
+        "semi-expanded",
+        "expanded",
+        "extra-expanded",
+        "ultra-expanded",
+        "wider",
+        "narrower",
+    ]
+    # options["patch.force_edgecolor"] = [True, False, None]
+    options["font.variant"] = ["normal", "small-caps"]
+    options["image.interpolation"] = [
+        "antialiased",
+        "nearest",
+        "bilinear",
+        "bicubic",
+        "spline16",
+        "spline36",
+        "hanning",
+        "hamming",
+        "hermite",
+        "kaiser",
+        "quadric",
+        "catrom",
+        "gaussian",
+        "bessel",
+        "mitchell",
+        "sinc",
+        "lanczos",
+        None,
+        "none",
+    ]
+    for key in [
+        "boxplot.flierprops.marker",
+        "boxplot.meanprops.marker",
+        "lines.marker",
+        "scatter.marker",
+    ]:
+        options[key] = list(markers.MarkerStyle.markers.keys())
+    for key in [
+        "axes.labelweight",
+        "axes.titleweight",
+        "figure.labelweight",
+        "figure.titleweight",
+        "font.weight",
+    ]:
+        options[key] = [
+            "light",
+            "normal",
+            "medium",
+            "semibold",
+            "bold",
+            "black",
+            None,
+        ]
+    options["axes.grid.axis"] = ["both", "x", "y"]
+    options["legend.loc"] = [
+        "best",
+        "upper right",
+        "upper left",
+        "lower left",
+        "lower right",
+        "right",
+        "center left",
+        "center right",
+        "lower center",
+        "upper center",
+        "center",
+    ]
+    options["pcolor.shading"] = ["auto", "flat", "nearest", "gouraud"]
+    options["text.hinting"] = ["default", "no_autohint", "force_autohint", "no_hinting"]
+
+    # Validated by functions which do not expose their choices
+    options["image.aspect"] = ["equal", "auto"]
+    options["savefig.bbox"] = ["tight", "standard"]
+    options["savefig.format"] = sorted(FigureCanvasBase.get_supported_filetypes())
+    options["toolbar"] = [None, "toolbar2", "toolmanager"]
+    options["ps.usedistiller"] = [None, "ghostscript", "xpdf"]
+    options["ps.papersize"] = ["figure", "letter", "legal", "ledger"] + [
+        f"{series}{i}" for series in "ab" for i in range(11)
+    ]
+    return options
+
+
+# Numeric ranges of validators checking them
+_RANGES = {
+    "_validate_greaterequal0_lessequal1": (0.0, 1.0),
+    "_validate_greaterthan_minushalf": (-0.5, None),
+}
+_COLOR_EXTRAS = {
+    "validate_color": [],
+    "validate_color_or_auto": ["auto"],
+    "validate_color_or_inherit": ["inherit"],
+    "_validate_color_or_linecolor": ["linecolor", "markerfacecolor", "markeredgecolor"],
+}
+
+
+def describe(validator) -> ParamSchema:
+    """Schema of the values accepted by an rcParam validator."""
+    schema = ParamSchema(kind="other", options=None, min=None, max=None, length=None)
+    name = getattr(validator, "__name__", type(validator).__name__)
+    if isinstance(validator, rcsetup.ValidateInStrings):
+        schema.update(kind="enum", options=list(validator.valid.values()))
+    elif isinstance(validator, type) and issubclass(validator, Enum):
+        schema.update(kind="enum", options=[member.value for member in validator])
+    elif name == "validate_bool":
+        schema.update(kind="bool")
+    elif name in _COLOR_EXTRAS:
+        schema.update(kind="color", options=_COLOR_EXTRAS[name])
+    elif name == "_validate_cmap":
+        schema.update(kind="cmap", options=sorted(colormaps))
+    elif name in ("validate_float", "validate_float_or_None") or name in _RANGES:
+        low, high = _RANGES.get(name, (None, None))
+        schema.update(kind="float", min=low, max=high)
+    elif name in ("validate_int", "validate_int_or_None"):
+        schema.update(kind="int")
+    elif name in ("validate_str", "validate_str_or_None"):
+        schema.update(kind="str")
+    elif name.endswith("list") and inspect.isfunction(validator):
+        # Built by `rcsetup._listify_validator`, which may fix their length
+        nonlocals = inspect.getclosurevars(validator).nonlocals
+        schema.update(kind="list", length=nonlocals.get("n"))
+    return schema
+
+
+def compile_schema() -> dict[str, ParamSchema]:
+    """Schema of every editable rcParam, merged with the manual options."""
+    schema = {
+        key: describe(rcsetup._validators[key])
+        for key in RCHelper.sorted_keys()
+        if key in rcsetup._validators
+    }
+    for key, options in _manual_options().items():
+        if key in schema:
+            schema[key].update(kind="enum", options=options)
+    return schema
+
+
+def cache_path(cache_dir: str) -> Path:
+    return Path(cache_dir) / f"rc_schema-mpl{mpl.__version__}-v{SCHEMA_VERSION}.json"
+
+
+@lru_cache(maxsize=None)
+def load_schema(cache_dir: str = settings.CACHE_DIR) -> dict[str, ParamSchema]:
+    """Schema from the disk cache, compiled and cached if missing."""
+    return load_json_cache(cache_path(cache_dir), compile_schema)
+
+
+@lru_cache(maxsize=None)
+def get_keys_options() -> dict[str, list]:
+    """Choices of the enum rcParams."""
+    return {k: s["options"] for k, s in load_schema().items() if s["kind"] == "enum"}
@@ -0,0 +1,490 @@
+import hashlib
+import json
+import math
+import os
+import struct
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from threading import Lock
+from typing import Any, Mapping, Optional, Sequence, TypedDict
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib import rcParamsDefault
+from matplotlib.figure import Figure
+from PIL import Image
+
+from style_sheets_reference import (
+    LIVE_FIGURES,
+    PANELS,
+    plot_figure,
+    plot_panel,
+    plot_title,
+)
+
+TITLE = "title"  # Background and title of the figure, under the panels
+ALL_TILES = PANELS + (TITLE,)
+
+# Bump when the preview renders differently, to miss the previews stored
+PREVIEW_VERSION = 2
+
+# Tiles of the preview affected by each rcParam, by key or key prefix. The
+# longest match wins, and keys without a match affect every tile.
+PANEL_DEPENDENCIES: dict[str, tuple[str, ...]] = {
+    # Not used when drawing the preview
+    "_internal.": (),
+    "agg.": (),
+    "animation.": (),
+    "backend": (),
+    "boxplot.": (),
+    "contour.": (),
+    "date.": (),
+    "docstring.": (),
+    "errorbar.": (),
+    "hatch.": (),
+    "interactive": (),
+    "keymap.": (),
+    "macosx.": (),
+    "pcolor.": (),
+    "pcolormesh.": (),
+    "pdf.": (),
+    "pgf.": (),
+    "polaraxes.": (),
+    "ps.": (),
+    "scatter.": (),  # The scatter panel uses `ax.plot`
+    "svg.": (),
+    "timezone": (),
+    "tk.": (),
+    "toolbar": (),
+    "webagg.": (),
+    # Panel specific
+    "hist.": ("histograms",),
+    "image.": ("image_and_patch",),
+    "legend.": ("bar_graphs",),
+    "markers.": ("scatter",),
+    # The cycle colors the circle of `image_and_patch` too
+    "axes.prop_cycle": PANELS,
+    # Axes decorations are in every panel, but not in the title, and so are
+    # lines (grid lines) and patches (axes backgrounds)
+    "axes.": PANELS,
+    "grid.": PANELS,
+    "lines.": PANELS,
+    "patch.": PANELS,
+    "xaxis.": PANELS,
+    "xtick.": PANELS,
+    "yaxis.": PANELS,
+    "ytick.": PANELS,
+}
+
+
+class DetailLevel(TypedDict):
+    dpi: float  # Fraction of the resolution
+    samples: float  # Fraction of the scatter points and line vertices plotted
+    layout: bool  # Whether the layout engine of the style runs, as but in drafts
+
+
+# Levels of detail of the preview, from full detail down
+DETAIL_LEVELS = (
+    DetailLevel(dpi=1.0, samples=1.0, layout=True),
+    DetailLevel(dpi=0.75, samples=0.5, layout=True),
+    DetailLevel(dpi=0.5, samples=0.25, layout=True),
+    DetailLevel(dpi=0.35, samples=0.1, layout=False),
+)
+
+
+class MemoryUsage(TypedDict):
+    live_figures: int
+    rss_bytes: Optional[int]
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    entries: int
+    nbytes: int
+    max_bytes: int
+
+
+class RenderCache:
+    """LRU cache of encoded images, bounded by a total byte budget.
+
+    Keys are content hashes of the rc overrides and the figure size, so the
+    cache can be shared by every session of the server.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(
+        overrides: Mapping[str, Any], figsize_px: Sequence[float], *extra: Any
+    ) -> str:
+        payload = json.dumps(
+            [
+                sorted((str(k), repr(v)) for k, v in overrides.items()),
+                [round(px) for px in figsize_px],
+                [repr(e) for e in extra],
+            ]
+        )
+        return hashlib.sha256(payload.encode("utf8")).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= len(old)
+            self._entries[key] = data
+            self._nbytes += len(data)
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                nbytes=self._nbytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+def preview_size(screen_width: Optional[float]) -> tuple[float, float]:
+    """Size in pixels of the preview for a screen width, if known."""
+    width = 1000 if screen_width is None else screen_width
+    return 0.5 * width, 0.25 * width
+
+
+def release_figure(fig: Figure) -> None:
+    """Drop the artists of a figure once it has been drawn.
+
+    Figures hold reference cycles, so they would otherwise linger with all
+    their artists until the garbage collector runs.
+    """
+    fig.clear()
+
+
+def memory_usage() -> MemoryUsage:
+    """Figures alive in this process and its resident memory, if known."""
+    rss_bytes = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    return MemoryUsage(live_figures=len(LIVE_FIGURES), rss_bytes=rss_bytes)
+
+
+@lru_cache(maxsize=None)
+def tiles_affected_by(key: str) -> tuple[str, ...]:
+    for prefix in sorted(PANEL_DEPENDENCIES, key=len, reverse=True):
+        if key.startswith(prefix):
+            return PANEL_DEPENDENCIES[prefix]
+    return ALL_TILES
+
+
+def tile_overrides(tile: str, overrides: Mapping[str, Any]) -> dict[str, Any]:
+    """Subset of `overrides` which `tile` depends on."""
+    return {k: v for k, v in overrides.items() if tile in tiles_affected_by(k)}
+
+
+class Tile(TypedDict):
+    pixels: np.ndarray  # RGBA, cropped to the pixels drawn for panels
+    offset: tuple[int, int]  # Row and column of the pixels in the figure
+    bbox: tuple[int, int, int, int]  # Left, top, right and bottom of the artists
+
+
+def _draw_tile(fig: Figure, dpi: float, crop: bool = False) -> Tile:
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer())  # In inches
+    arr = np.asarray(fig.canvas.buffer_rgba())
+    release_figure(fig)
+    height = arr.shape[0]
+    box = (
+        math.floor(bbox.x0 * dpi),
+        math.floor(height - bbox.y1 * dpi),
+        math.ceil(bbox.x1 * dpi),
+        math.ceil(height - bbox.y0 * dpi),
+    )
+    top, left = 0, 0
+    if crop:
+        # Panels are drawn on a transparent figure, around their cell
+        rows = np.flatnonzero(arr[..., 3].any(axis=1))
+        cols = np.flatnonzero(arr[..., 3].any(axis=0))
+        if rows.size:
+            top, left = int(rows[0]), int(cols[0])
+            arr = arr[top : rows[-1] + 1, left : cols[-1] + 1]
+        else:
+            arr = arr[:1, :1]
+    return Tile(pixels=arr.copy(), offset=(top, left), bbox=box)
+
+
+def _encode_tile(tile: Tile) -> bytes:
+    # The offset and box, then the pixels as a PNG quick to encode
+    out = BytesIO()
+    out.write(struct.pack("<6i", *tile["offset"], *tile["bbox"]))
+    Image.fromarray(tile["pixels"]).save(out, format="png", compress_level=1)
+    return out.getvalue()
+
+
+def _decode_tile(data: bytes) -> Tile:
+    header = struct.unpack_from("<6i", data)
+    with Image.open(BytesIO(data[struct.calcsize("<6i") :])) as image:
+        pixels = np.asarray(image.convert("RGBA"))
+    return Tile(pixels=pixels, offset=header[:2], bbox=header[2:])
+
+
+def _get_tile(
+    tile: str,
+    overrides: Mapping[str, Any],
+    figsize_px: Sequence[float],
+    dpi: float,
+    cache: RenderCache,
+    samples: float = 1.0,
+) -> Tile:
+    key = RenderCache.make_key(
+        tile_overrides(tile, overrides),
+        figsize_px,
+        "tile",
+        tile,
+        dpi,
+        *((samples,) if samples != 1.0 else ()),
+    )
+    data = cache.get(key)
+    if data is not None:
+        return _decode_tile(data)
+    if tile == TITLE:
+        drawn = _draw_tile(plot_title(figsize_px), dpi)
+    else:
+        drawn = _draw_tile(plot_panel(tile, figsize_px, samples), dpi, crop=True)
+    cache.put(key, _encode_tile(drawn))
+    return drawn
+
+
+def _composite(background: Tile, panels: Sequence[Tile], pad: int) -> np.ndarray:
+    """
+    Panels drawn over the `background` of the figure, cropped to their
+    artists with a margin of `pad` pixels, as `savefig(bbox_inches="tight")`.
+    """
+    out = background["pixels"].copy()
+    for tile in panels:
+        top, left = tile["offset"]
+        height, width = tile["pixels"].shape[:2]
+        dst = out[top : top + height, left : left + width]
+        src = tile["pixels"].astype(np.float32) / 255
+        under = dst.astype(np.float32) / 255
+        # Alpha compositing of the panel over what is under it
+        src_alpha = src[..., 3:]
+        under_alpha = under[..., 3:] * (1 - src_alpha)
+        alpha = src_alpha + under_alpha
+        rgb = src[..., :3] * src_alpha + under[..., :3] * under_alpha
+        dst[..., :3] = np.round(255 * rgb / np.maximum(alpha, 1e-6))
+        dst[..., 3:] = np.round(255 * alpha)
+    boxes = [tile["bbox"] for tile in (background, *panels)]
+    height, width = out.shape[:2]
+    left = max(0, min(box[0] for box in boxes) - pad)
+    top = max(0, min(box[1] for box in boxes) - pad)
+    right = min(width, max(box[2] for box in boxes) + pad)
+    bottom = min(height, max(box[3] for box in boxes) + pad)
+    return out[top:bottom, left:right]
+
+
+def uses_layout_engine() -> bool:
+    """Whether the current rcParams lay the panels out by their content."""
+    return bool(
+        mpl.rcParams["figure.autolayout"]
+        or mpl.rcParams["figure.constrained_layout.use"]
+    )
+
+
+def image_key(
+    overrides: Mapping[str, Any],
+    figsize_px: Sequence[float],
+    dpi: float = 200,
+    fmt: str = "png",
+    quality: int = 85,
+    draft: bool = False,
+    detail: int = 0,
+) -> str:
+    """Cache key of the preview image rendered by `render_figure`."""
+    return RenderCache.make_key(
+        overrides,
+        figsize_px,
+        dpi,
+        fmt,
+        None if fmt == "png" else quality,
+        draft,
+        f"v{PREVIEW_VERSION}",
+        *((detail,) if detail else ()),
+    )
+
+
+def encode_image(arr: np.ndarray, fmt: str = "png", quality: int = 85) -> bytes:
+    """Encode an RGBA image as PNG, or lossily as WebP or JPEG."""
+    image = Image.fromarray(arr)
+    options = {}
+    if fmt != "png":
+        options["quality"] = quality
+    if fmt == "jpeg":
+        image = image.convert("RGB")
+    out = BytesIO()
+    image.save(out, format=fmt, **options)
+    return out.getvalue()
+
+
+def render_figure(
+    overrides: Mapping[str, Any],
+    figsize_px: Sequence[float],
+    cache: RenderCache,
+    dpi: float = 200,
+    fmt: str = "png",
+    quality: int = 85,
+    draft: bool = False,
+    detail: int = 0,
+) -> bytes:
+    """
+    Render the preview figure to image bytes (see `encode_image`), with
+    `overrides` on top of the default rcParams, cropped to its artists.
+
+    Without a layout engine, the cells of the panels do not depend on their
+    content. Each panel is then drawn in its cell on its own, cached keyed
+    by the `overrides` it depends on (see `PANEL_DEPENDENCIES`), and
+    composited over the background of the figure, so editing a key only
+    redraws the panels it affects. With a layout engine, the whole figure
+    is drawn at once. The encoded image is cached as well. Drafts skip the
+    layout engine, to be shown quickly while the image renders. Lower
+    levels of detail (see `DETAIL_LEVELS`) lower the resolution, plot fewer
+    samples and eventually skip the layout engine, to render slow styles
+    quicker.
+    """
+    key = image_key(overrides, figsize_px, dpi, fmt, quality, draft, detail)
+    image = cache.get(key)
+    if image is not None:
+        return image
+    level = DETAIL_LEVELS[detail]
+    dpi *= level["dpi"]
+    layout = not draft and level["layout"]
+    with mpl.rc_context(rcParamsDefault), mpl.rc_context(overrides):
+        pad = round(mpl.rcParams["savefig.pad_inches"] * dpi)
+        if layout and uses_layout_engine():
+            fig = plot_figure(figsize_px, samples=level["samples"])
+            arr = _composite(_draw_tile(fig, dpi), [], pad)
+        else:
+            panels = [
+                _get_tile(tile, overrides, figsize_px, dpi, cache, level["samples"])
+                for tile in PANELS
+            ]
+            background = _get_tile(TITLE, overrides, figsize_px, dpi, cache)
+            arr = _composite(background, panels, pad)
+    image = encode_image(arr, fmt, quality)
+    cache.put(key, image)
+    return image
+
+
+def _sample_value(key: str, schema: Mapping[str, Any]) -> Any:
+    # A value of `key` other than its default, None if there is no obvious one
+    from cycler import cycler
+
+    default = rcParamsDefault[key]
+    kind, options = schema["kind"], schema["options"] or []
+    if key == "axes.prop_cycle":
+        return cycler(color=["red", "green"])
+    if kind == "bool":
+        return not default
+    if kind == "color":
+        return "red" if default != "red" else "blue"
+    if kind in ("enum", "cmap"):
+        return next((o for o in options if str(o) != str(default)), None)
+    if kind in ("float", "int") and isinstance(default, (int, float)):
+        value = 2 * default + 1
+        if schema["max"] is not None and value > schema["max"]:
+            value = schema["min"] if default != schema["min"] else schema["max"]
+        return int(value) if kind == "int" else value
+    return None
+
+
+def _draw_tiles(
+    tiles: Sequence[str], overrides: Mapping[str, Any], figsize_px: Sequence[float]
+) -> dict[str, np.ndarray]:
+    with mpl.rc_context(rcParamsDefault), mpl.rc_context(overrides):
+        dpi = mpl.rcParams["figure.dpi"]
+        return {
+            tile: _draw_tile(
+                (
+                    plot_title(figsize_px)
+                    if tile == TITLE
+                    else plot_panel(tile, figsize_px)
+                ),
+                dpi,
+            )["pixels"]
+            for tile in tiles
+        }
+
+
+def undeclared_dependencies(
+    figsize_px: Sequence[float] = (600, 300),
+) -> dict[str, list[str]]:
+    """
+    Tiles which change with an rcParam but are not in `PANEL_DEPENDENCIES`,
+    by key. Each key matching an entry is set to a value other than its
+    default, when the schema suggests one, and the tiles it should leave
+    unchanged are drawn and compared.
+    """
+    from rc_schema import load_schema
+
+    base = _draw_tiles(ALL_TILES, {}, figsize_px)
+    found = {}
+    for key, schema in load_schema().items():
+        unaffected = [t for t in ALL_TILES if t not in tiles_affected_by(key)]
+        value = _sample_value(key, schema)
+        if not unaffected or value is None or value == rcParamsDefault[key]:
+            continue
+        try:
+            tiles = _draw_tiles(unaffected, {key: value}, figsize_px)
+        except Exception as e:
+            found[key] = [f"error: {e}"]
+            continue
+        changed = [
+            tile
+            for tile, arr in tiles.items()
+            if arr.shape != base[tile].shape or (arr != base[tile]).any()
+        ]
+        if changed:
+            found[key] = changed
+    return found
+
+
+if __name__ == "__main__":
+    # Check the map of the tiles affected by each rcParam
+    found = undeclared_dependencies()
+    for key, tiles in found.items():
+        print(f"{key}: {', '.join(tiles)}")
+    raise SystemExit(1 if found else 0)
@@ -0,0 +1,503 @@
+import time
+from collections import deque
+from concurrent.futures import (
+    CancelledError,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from multiprocessing import get_context
+from threading import BoundedSemaphore, RLock
+from typing import Any, Callable, Mapping, Optional, Sequence, TypedDict
+
+import settings
+from font_catalog import load_catalog, preload_fonts
+from render import (
+    DETAIL_LEVELS,
+    MemoryUsage,
+    RenderCache,
+    image_key,
+    memory_usage,
+    render_figure,
+)
+
+# Cache of the panels rendered by a worker process, see `_init_worker`
+_worker_cache: Optional[RenderCache] = None
+
+
+def _init_worker(cache_bytes: int) -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    load_catalog()
+    global _worker_cache
+    _worker_cache = RenderCache(cache_bytes)
+
+
+def _render_job(
+    overrides: dict[str, Any],
+    figsize_px: tuple[float, ...],
+    dpi: float,
+    fmt: str,
+    quality: int,
+    draft: bool,
+    detail: int,
+) -> tuple[bytes, MemoryUsage]:
+    # The memory of the worker is reported with the image, for the server
+    assert _worker_cache is not None
+    preload_fonts(overrides)
+    image = render_figure(
+        overrides, figsize_px, _worker_cache, dpi, fmt, quality, draft, detail
+    )
+    return image, memory_usage()
+
+
+class RenderQueueFull(RuntimeError):
+    pass
+
+
+class RenderPool:
+    """
+    Renders previews in the background, in a pool of Agg worker processes.
+
+    Jobs take rc overrides and a figure size in pixels, and return images
+    encoded as `fmt` at `dpi`, or drafts at `draft_dpi`, at a level of
+    detail (see `render.DETAIL_LEVELS`). At most
+    `max_pending` jobs are queued or running at once, and a new job from a
+    session cancels its previous one (or draft) if it has not started yet.
+    Jobs wait in a queue of the server until their worker is idle, so that
+    they can still be cancelled, instead of in the call queue of the worker.
+    Finished images are cached in `cache`, which is checked before
+    submitting. With `max_workers=0`, jobs are rendered in a single
+    background thread of the server, one at a time since the rcParams are
+    global.
+
+    Each worker caches the panels it rendered, so that an edit redraws only
+    the panels it affects. Jobs of a session therefore go to the same worker
+    while it is idle, and to the least busy worker otherwise, when the
+    panels of the session are rendered again.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = settings.RENDER_WORKERS,
+        max_pending: int = settings.RENDER_QUEUE_SIZE,
+        timeout: float = settings.RENDER_TIMEOUT,
+        cache: Optional[RenderCache] = None,
+        dpi: float = settings.PREVIEW_DPI,
+        draft_dpi: float = settings.DRAFT_DPI,
+        fmt: str = settings.PREVIEW_FORMAT,
+        quality: int = settings.PREVIEW_QUALITY,
+    ) -> None:
+        self.timeout = timeout
+        self.dpi = dpi
+        self.draft_dpi = draft_dpi
+        self.fmt = fmt
+        self.quality = quality
+        self.cache = (
+            RenderCache(settings.RENDER_CACHE_BYTES) if cache is None else cache
+        )
+        # A single process executor per worker, to choose the worker of a job
+        self._executors: list[Executor]
+        self._in_processes = max_workers > 0
+        if self._in_processes:
+            context = get_context("spawn")
+            self._executors = [
+                ProcessPoolExecutor(
+                    1,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(settings.WORKER_CACHE_BYTES,),
+                )
+                for _ in range(max_workers)
+            ]
+        else:
+            self._executors = [ThreadPoolExecutor(1, thread_name_prefix="render")]
+        self._busy = [0] * len(self._executors)  # Jobs queued or running, by worker
+        self._running = [False] * len(self._executors)
+        # Memory of the worker processes, as of the last job they rendered
+        self._usage: list[Optional[MemoryUsage]] = [None] * len(self._executors)
+        # Jobs waiting for their worker, as futures and the call to render them
+        self._queues: list[deque[tuple[Future, Callable, tuple]]] = [
+            deque() for _ in self._executors
+        ]
+        self._slots = BoundedSemaphore(max_pending)
+        self._jobs: dict[tuple[str, bool], Future] = {}
+        # Reentrant, as a job may finish while `_dispatch` adds its callback
+        self._lock = RLock()
+
+    def key(
+        self,
+        overrides: Mapping[str, Any],
+        figsize_px: Sequence[float],
+        draft: bool = False,
+        detail: int = 0,
+    ) -> str:
+        """Cache key of an image, or of its draft, rendered by the pool."""
+        return image_key(overrides, figsize_px, *self._options(draft, detail))
+
+    def _options(self, draft: bool, detail: int = 0) -> tuple:
+        # Arguments of `render_figure` after the cache
+        dpi = self.draft_dpi if draft else self.dpi
+        return dpi, self.fmt, self.quality, draft, detail
+
+    def submit(
+        self,
+        session_id: str,
+        overrides: Mapping[str, Any],
+        figsize_px: Sequence[float],
+        draft: bool = False,
+        detail: int = 0,
+    ) -> Future:
+        key = self.key(overrides, figsize_px, draft, detail)
+        future: Future = Future()
+        image = self.cache.get(key)
+        if image is not None:
+            future.set_result(image)
+            return future
+
+        job = (session_id, draft)
+        with self._lock:
+            stale = self._jobs.pop(job, None)
+        if stale is not None:
+            stale.cancel()
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull("Too many renders in progress")
+        options = self._options(draft, detail)
+        if self._in_processes:
+            call: tuple = (_render_job, (dict(overrides), tuple(figsize_px), *options))
+        else:
+            # Renders in the server thread cache their panels in `cache`
+            call = (
+                render_figure,
+                (dict(overrides), tuple(figsize_px), self.cache, *options),
+            )
+        with self._lock:
+            worker = self._worker(session_id)
+            self._busy[worker] += 1
+            self._jobs[job] = future
+            self._queues[worker].append((future, *call))
+            self._dispatch(worker)
+
+        def done(f: Future) -> None:
+            self._slots.release()
+            with self._lock:
+                self._busy[worker] -= 1
+                if self._jobs.get(job) is f:
+                    del self._jobs[job]
+            if self._in_processes and not f.cancelled() and f.exception() is None:
+                self.cache.put(key, f.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def _dispatch(self, worker: int) -> None:
+        # Start the next job queued for `worker` which was not cancelled, if idle
+        queue = self._queues[worker]
+        while queue and not self._running[worker]:
+            future, fn, args = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                running = self._executors[worker].submit(fn, *args)
+            except RuntimeError as e:  # The executor was shut down
+                future.set_exception(e)
+                continue
+            self._running[worker] = True
+            running.add_done_callback(
+                lambda r, future=future: self._finish(worker, future, r)
+            )
+
+    def _finish(self, worker: int, future: Future, running: Future) -> None:
+        with self._lock:
+            self._running[worker] = False
+            self._dispatch(worker)
+        if running.cancelled():
+            future.set_exception(CancelledError("The render pool was shut down"))
+        elif running.exception() is not None:
+            future.set_exception(running.exception())
+        elif self._in_processes:
+            image, self._usage[worker] = running.result()
+            future.set_result(image)
+        else:
+            future.set_result(running.result())
+
+    def memory_usage(self) -> MemoryUsage:
+        """
+        Figures alive and resident memory of the server and its workers, those
+        of the workers as of their last render.
+        """
+        total = memory_usage()
+        for usage in self._usage:
+            if usage is None:
+                continue
+            total["live_figures"] += usage["live_figures"]
+            if total["rss_bytes"] is not None and usage["rss_bytes"] is not None:
+                total["rss_bytes"] += usage["rss_bytes"]
+        return total
+
+    def _worker(self, session_id: str) -> int:
+        # The worker of the session if idle, which has its panels cached
+        home = hash(session_id) % len(self._executors)
+        if self._busy[home] == 0:
+            return home
+        return min(range(len(self._busy)), key=self._busy.__getitem__)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            queued = [job[0] for queue in self._queues for job in queue]
+        for future in queued:
+            future.cancel()
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SessionPreview:
+    """
+    Preview of a session, rendered in the background.
+
+    `request` submits a draft and the image of new overrides, superseding
+    those of previous requests, and `poll` takes the newest render that
+    finished. The last image completed is kept in `image`, to be shown
+    until a newer one lands, and why the render of the last request failed
+    in `error`, if it did. When the queue of the pool is full, the image
+    is submitted by a later `poll`.
+
+    With a `budget` in seconds, images are rendered at the level of detail
+    `detail`, lowered when a render takes longer than the budget and raised
+    when one takes less than half of it. Images of lower detail are then
+    rendered again at full detail, while the session is idle.
+    """
+
+    def __init__(self, budget: float = settings.PREVIEW_BUDGET) -> None:
+        self.budget = budget
+        self.detail = 0  # Level of detail of the next images
+        self.key: Optional[str] = None
+        self.figsize_px: Optional[Sequence[float]] = None
+        self.image: Optional[bytes] = None
+        self.image_detail = 0
+        self.error: Optional[str] = None  # Why the last render failed, if it did
+        # Session, overrides, size and detail of the image to render, until it is
+        self._job: Optional[tuple[str, dict[str, Any], tuple[float, ...], int]] = None
+        self._draft: Optional[Future] = None
+        self._future: Optional[Future] = None
+        self._requested = 0.0
+        self._submitted: Optional[float] = None  # None when the image was cached
+        self._finished: Optional[float] = None
+
+    @property
+    def pending(self) -> bool:
+        return self._job is not None
+
+    def completed(self, pool: RenderPool, overrides: Mapping[str, Any]) -> bool:
+        """Whether `image` is the full render of `overrides`."""
+        return (
+            self.image is not None
+            and not self.pending
+            and self.image_detail == 0
+            and self.figsize_px is not None
+            and self.key == pool.key(overrides, self.figsize_px)
+        )
+
+    def request(
+        self,
+        pool: RenderPool,
+        session_id: str,
+        overrides: Mapping[str, Any],
+        figsize_px: Sequence[float],
+    ) -> None:
+        """Render the preview of `overrides`, unless it was already requested."""
+        key = pool.key(overrides, figsize_px)
+        if key == self.key:
+            return
+        self.key, self.figsize_px = key, figsize_px
+        self.error = None
+        self._job = self._draft = self._future = None
+        image = pool.cache.get(key)
+        if image is not None:
+            self.image, self.image_detail = image, 0
+            return
+        self._job = (session_id, dict(overrides), tuple(figsize_px), self.detail)
+        self._requested = time.monotonic()
+        if pool.draft_dpi:
+            try:
+                self._draft = pool.submit(session_id, overrides, figsize_px, True)
+            except RenderQueueFull:
+                pass
+        self._submit(pool)
+
+    def _submit(self, pool: RenderPool) -> None:
+        assert self._job is not None
+        session_id, overrides, figsize_px, detail = self._job
+        try:
+            self._future = pool.submit(session_id, overrides, figsize_px, detail=detail)
+        except RenderQueueFull:
+            return
+        self._submitted = None if self._future.done() else time.monotonic()
+        self._finished = None
+        self._future.add_done_callback(self._on_done)
+
+    def _on_done(self, future: Future) -> None:
+        # The end of the render, rather than of the poll which takes it
+        if future is self._future:
+            self._finished = time.monotonic()
+
+    def _adapt(self, pool: RenderPool, job: tuple) -> None:
+        """Level of detail of the next images, after one rendered for `job`."""
+        detail = job[3]
+        if self._submitted is not None and detail == self.detail:
+            # `poll` may see the future done before its callbacks ran
+            end = time.monotonic() if self._finished is None else self._finished
+            elapsed = end - self._submitted
+            if elapsed > self.budget:
+                self.detail = min(detail + 1, len(DETAIL_LEVELS) - 1)
+            elif elapsed < self.budget / 2:
+                self.detail = max(detail - 1, 0)
+        if detail > 0:
+            # Render it at full detail, superseded by the next request
+            self._job = job[:3] + (0,)
+            self._requested = time.monotonic()
+            self._submit(pool)
+
+    def poll(self, pool: RenderPool) -> None:
+        """
+        Take the image, or draft, that finished since the last poll.
+
+        Keeps the error of a failed render in `error`, and raises
+        `TimeoutError` when the image took longer than the `timeout` of `pool`.
+        """
+        if self._job is None:
+            return
+        if self._future is None:
+            # The queue was full when submitted, e.g. as the draft took the last slot
+            self._submit(pool)
+        future = self._future
+        if future is not None and future.done():
+            job, self._job = self._job, None
+            self._draft = self._future = None
+            if future.cancelled():
+                self.key = None  # Request it again
+                return
+            exception = future.exception()
+            if exception is not None:
+                self.error = repr(exception)
+                return
+            self.image, self.image_detail = future.result(), job[3]
+            if self.budget:
+                self._adapt(pool, job)
+        elif time.monotonic() - self._requested > pool.timeout:
+            if future is not None:
+                future.cancel()
+            self._job = self._draft = self._future = None
+            self.key = None
+            raise TimeoutError
+        elif self._draft is not None and self._draft.done():
+            draft, self._draft = self._draft, None
+            if not draft.cancelled() and draft.exception() is None:
+                self.image = draft.result()
+
+
+class ComparedStyle(TypedDict):
+    image: Optional[bytes]
+    seconds: float  # From the submission of the render to its end
+    error: Optional[str]  # Why the render failed, if it did
+
+
+class StyleComparison:
+    """
+    Styles of a session rendered side by side, in the background.
+
+    `request` submits the renders of the styles, superseding those of
+    previous requests, and `poll` takes the renders that finished into
+    `results`, by name. A render which failed has an `error` instead of an
+    image. Renders beyond the free slots of the pool are submitted by later
+    polls.
+    """
+
+    def __init__(self) -> None:
+        self.key: Optional[tuple] = None
+        self.styles: dict[str, Mapping[str, Any]] = {}
+        self.results: dict[str, ComparedStyle] = {}
+        self._session_id = ""
+        self._figsize_px: tuple[float, ...] = ()
+        self._todo: list[str] = []
+        self._futures: dict[str, Future] = {}
+        self._submitted: dict[str, float] = {}
+        self._finished: dict[str, float] = {}
+        self._requested = 0.0
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._todo or self._futures)
+
+    def request(
+        self,
+        pool: RenderPool,
+        session_id: str,
+        overrides_by_name: Mapping[str, Mapping[str, Any]],
+        figsize_px: Sequence[float],
+    ) -> None:
+        """Render the styles of `overrides_by_name`, unless already requested."""
+        key = tuple(
+            (name, pool.key(overrides, figsize_px))
+            for name, overrides in overrides_by_name.items()
+        )
+        if key == self.key:
+            return
+        for future in self._futures.values():
+            future.cancel()
+        self.key = key
+        self.styles = dict(overrides_by_name)
+        self.results = {}
+        self._session_id, self._figsize_px = session_id, tuple(figsize_px)
+        self._todo = list(overrides_by_name)
+        self._futures, self._submitted, self._finished = {}, {}, {}
+        self._requested = time.monotonic()
+        self._submit(pool)
+
+    def _submit(self, pool: RenderPool) -> None:
+        finished = self._finished  # Not those of a later request
+        while self._todo:
+            name = self._todo[0]
+            try:
+                future = pool.submit(
+                    f"{self._session_id}/{name}", self.styles[name], self._figsize_px
+                )
+            except RenderQueueFull:
+                return
+            self._todo.pop(0)
+            self._submitted[name] = time.perf_counter()
+            future.add_done_callback(
+                lambda f, name=name: finished.setdefault(name, time.perf_counter())
+            )
+            self._futures[name] = future
+
+    def poll(self, pool: RenderPool) -> None:
+        """
+        Take the renders that finished since the last poll, and submit those
+        waiting for a slot. Raises `TimeoutError` when the styles took longer
+        than the `timeout` of `pool`.
+        """
+        for name, future in list(self._futures.items()):
+            if not future.done():
+                continue
+            del self._futures[name]
+            # `wait` may return before the callbacks of the future ran
+            end = self._finished.get(name, time.perf_counter())
+            seconds = end - self._submitted[name]
+            if future.cancelled():
+                error: Optional[str] = "The render was cancelled"
+            else:
+                exception = future.exception()
+                error = None if exception is None else repr(exception)
+            self.results[name] = ComparedStyle(
+                image=None if error else future.result(), seconds=seconds, error=error
+            )
+        self._submit(pool)
+        if self.pending and time.monotonic() - self._requested > pool.timeout:
+            for future in self._futures.values():
+                future.cancel()
+            self._todo, self._futures = [], {}
+            self.key = None  # Request them again
+            raise TimeoutError
@@ -0,0 +1,58 @@
+"""Server settings, read from `MPLSTYLER_*` environment variables."""
+
+import os
+
+
+def _get(name: str, default, type=int):
+    value = os.environ.get(f"MPLSTYLER_{name}")
+    return default if value is None else type(value)
+
+
+# Number of worker processes rendering previews, 0 renders in a server thread
+RENDER_WORKERS: int = _get("RENDER_WORKERS", min(4, os.cpu_count() or 1))
+# Renders waiting for or running on a worker before new ones are rejected
+RENDER_QUEUE_SIZE: int = _get("RENDER_QUEUE_SIZE", 2 * max(RENDER_WORKERS, 1))
+# Seconds to wait for a render
+RENDER_TIMEOUT: float = _get("RENDER_TIMEOUT", 30.0, float)
+# Byte budget of the render cache of the server
+RENDER_CACHE_BYTES: int = _get("RENDER_CACHE_BYTES", 256 * 2**20)
+# Byte budget of the panels cached by each worker process
+WORKER_CACHE_BYTES: int = _get("WORKER_CACHE_BYTES", 64 * 2**20)
+# Resolution of the preview, and of the draft shown while it renders (0: none)
+PREVIEW_DPI: float = _get("PREVIEW_DPI", 200.0, float)
+DRAFT_DPI: float = _get("DRAFT_DPI", 50.0, float)
+# Image format of the preview (png, webp or jpeg), and quality of webp and jpeg
+PREVIEW_FORMAT: str = _get("PREVIEW_FORMAT", "png", str)
+PREVIEW_QUALITY: int = _get("PREVIEW_QUALITY", 85)
+# Seconds within which to render the preview, lowering its level of detail for
+# styles which render slower and raising it back when idle (0: full detail)
+PREVIEW_BUDGET: float = _get("PREVIEW_BUDGET", 0.0, float)
+# Edits of a session that can be undone
+HISTORY_SIZE: int = _get("HISTORY_SIZE", 100)
+# Byte budget of the previews kept by the edit history of a session, those of
+# the edits linked last (older edits find theirs in the render cache, if any)
+HISTORY_PREVIEW_BYTES: int = _get("HISTORY_PREVIEW_BYTES", 2 * 2**20)
+# Seconds between checks of the preview rendering in the background
+PREVIEW_POLL_INTERVAL: float = _get("PREVIEW_POLL_INTERVAL", 0.25, float)
+# Time the stages of each rerun and show them in the sidebar
+PROFILE: bool = _get("PROFILE", False, lambda v: v.lower() in ("1", "true", "yes"))
+# File to which a JSON line is appended per rerun when profiling
+PROFILE_LOG: str = _get("PROFILE_LOG", "", str)
+# Directory of caches shared by server restarts and worker processes
+CACHE_DIR: str = _get(
+    "CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "mplstyler"
+    ),
+    str,
+)
+# SQLite database of the saved styles
+LIBRARY_PATH: str = _get(
+    "LIBRARY_PATH",
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")),
+        "mplstyler",
+        "library.sqlite3",
+    ),
+    str,
+)
@@ -0,0 +1,100 @@
+"""
+Warm-up of the caches of the server, so that its first sessions do not pay
+for them.
+
+The app warms the in-memory caches and renders the default previews once per
+server process. Run this script when building or deploying the server, to
+build the disk caches (matplotlib's font list, the rcParam schema) beforehand
+and to report cold and warm timings:
+
+    python startup.py
+"""
+
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Optional, Sequence
+
+if TYPE_CHECKING:
+    from render_pool import RenderPool
+
+# Screen widths of the previews rendered at startup: the width assumed
+# before the browser reports it, and the most common one
+SCREEN_WIDTHS = (None, 1920)
+
+
+@contextmanager
+def _timed(timings: dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def warm_up(
+    pool: Optional["RenderPool"] = None,
+    screen_widths: Sequence[Optional[float]] = SCREEN_WIDTHS,
+) -> dict[str, float]:
+    """
+    Load the caches of the app, returning the seconds spent on each.
+
+    The default previews are submitted to `pool`, if given, without waiting
+    for them.
+    """
+    timings: dict[str, float] = {}
+    with _timed(timings, "fonts"):
+        from matplotlib import font_manager
+
+        font_manager.findfont(font_manager.FontProperties())
+    with _timed(timings, "font_catalog"):
+        from font_catalog import load_catalog
+
+        load_catalog()
+    with _timed(timings, "schema"):
+        from rc_schema import load_schema
+
+        load_schema()
+    with _timed(timings, "widget_table"):
+        from widgets import widget_table
+
+        widget_table()
+    with _timed(timings, "key_index"):
+        from key_index import key_index
+
+        key_index()
+    if pool is not None:
+        from render import preview_size
+        from render_pool import RenderQueueFull
+
+        with _timed(timings, "render"):
+            for width in screen_widths:
+                try:
+                    pool.submit(f"startup/{width}", {}, preview_size(width))
+                except RenderQueueFull:
+                    break
+    return timings
+
+
+def main():
+    start = time.perf_counter()
+    import helper  # noqa: F401
+    import render_pool  # noqa: F401
+
+    imports = time.perf_counter() - start
+    cold = warm_up()
+    warm = warm_up()
+    # Rendering warms the font files and sample data of a process
+    from render import RenderCache, preview_size, render_figure
+
+    for timings in (cold, warm):
+        with _timed(timings, "render"):
+            render_figure({}, preview_size(None), RenderCache())
+    print(f"{'imports':<15} {1000 * imports:10.1f} ms")
+    print(f"{'':<15} {'cold':>10} {'warm':>10}")
+    for name in cold:
+        print(f"{name:<15} {1000 * cold[name]:8.1f} ms {1000 * warm[name]:7.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
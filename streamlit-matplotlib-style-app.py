@@ -1,129 +1,160 @@
-import re
-from difflib import get_close_matches
-from io import BytesIO
+from pathlib import Path
 
-import matplotlib.pyplot as plt
 import streamlit as st
-from matplotlib import markers, matplotlib_fname
 from PIL import Image
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_js_eval import streamlit_js_eval
 
-from helper import DFHelper, RCHelper
-from style_sheets_reference import plot_figure
-
-
-@st.cache_data
-def get_keys_options():
-    options = {}
-    with open(matplotlib_fname(), "r") as f:
-        for line in f:
-            s = line.split(": ")
-            if len(s) > 1 and not s[0].startswith("##"):
-                vals = re.findall(r"^.*\{(.*)\}.*$", s[1], re.UNICODE)
-                if len(vals) > 0:
-                    key = re.sub(r"^(\#*)(.*?)$", r"\2", s[0], flags=re.UNICODE).strip()
-                    if key.startswith("_"):
-                        continue
-                    options[key] = [v.strip() for v in vals[0].split(",")]
-                for i in range(2, len(s)):
-                    vals = re.findall(r"^.*\{(.*)\}.*$", s[i], re.UNICODE)
-                    if len(vals) > 0:
-                        options[key] += [v.strip() for v in vals[0].split(",")]
-    options["axes.autolimit_mode"] = ["data", "round_numbers"]
-    options["axes.axisbelow"] = [True, "line", False]
-    for key in ["axes.titlelocation", "xaxis.labellocation", "xtick.alignment"]:
-        options[key] = ["center", "left", "right"]
-    for key in ["yaxis.labellocation"]:
-        options[key] = ["bottom", "top", "center"]
-    for key in ["xtick.direction", "ytick.direction"]:
-        options[key] = ["in", "out", "inout"]
-    options["ytick.alignment"] = [
-        "bottom",
-        "baseline",
-        "center",
-        "center_baseline",
-        "top",
-    ]
-
-    options["font.stretch"] = [
-        "ultra-condensed",
-        "extra-condensed",
-        "condensed",
-        "semi-condensed",
-        "normal",
-        "semi-expanded",
-        "expanded",
-        "extra-expanded",
-        "ultra-expanded",
-        "wider",
-        "narrower",
-    ]
-    # options["patch.force_edgecolor"] = [True, False, None]
-    options["font.variant"] = ["normal", "small-caps"]
-    options["image.interpolation"] = [
-        "antialiased",
-        "nearest",
-        "bilinear",
-        "bicubic",
-        "spline16",
-        "spline36",
-        "hanning",
-        "hamming",
-        "hermite",
-        "kaiser",
-        "quadric",
-        "catrom",
-        "gaussian",
-        "bessel",
-        "mitchell",
-        "sinc",
-        "lanczos",
-        None,
-        "none",
-    ]
-    for key in [
-        "boxplot.flierprops.marker",
-        "boxplot.meanprops.marker",
-        "lines.marker",
-        "scatter.marker",
-    ]:
-        options[key] = list(markers.MarkerStyle.markers.keys())
-    for key in [
-        "axes.labelweight",
-        "axes.titleweight",
-        "figure.labelweight",
-        "figure.titleweight",
-        "font.weight",
-    ]:
-        options[key] = [
-            "light",
-            "normal",
-            "medium",
-            "semibold",
-            "bold",
-            "black",
-            None,
-        ]
-    options["axes.grid.axis"] = ["both", "x", "y"]
-    options["legend.loc"] = [
-        "best",
-        "upper right",
-        "upper left",
-        "lower left",
-        "lower right",
-        "right",
-        "center left",
-        "center right",
-        "lower center",
-        "upper center",
-        "center",
-    ]
-    options["pcolor.shading"] = ["auto", "flat", "nearest", "gouraud"]
-    options["text.hinting"] = ["default", "no_autohint", "force_autohint", "no_hinting"]
-    return options
+import settings
+from font_catalog import missing_families
+from helper import DFHelper, RCHelper, RCOverrides
+from history import EditHistory, Snapshot
+from instrumentation import RerunTimer, deep_sizeof
+from key_index import suggest
+from render import DETAIL_LEVELS, preview_size
+from render_pool import RenderPool, SessionPreview, StyleComparison
+from startup import warm_up
+from style_io import (
+    FORMATS,
+    builtin_style_names,
+    export_style,
+    file_name,
+    import_builtin,
+    import_file,
+    imported_style,
+    style_overrides,
+)
+from style_library import StyleLibrary
+from widgets import widget_description
+
+STATIC = Path(__file__).parent / "static"
+CURRENT_STYLE = "Current style"
+
+
+@st.cache_resource
+def get_render_pool():
+    return RenderPool()
+
+
+@st.cache_resource(show_spinner="Warming up...")
+def get_startup_timings() -> dict[str, float]:
+    """Warm the caches of the server, once per process."""
+    return warm_up(get_render_pool())
+
+
+@st.cache_resource
+def static_file(name: str) -> bytes:
+    return (STATIC / name).read_bytes()
+
+
+@st.cache_resource
+def static_image(name: str) -> Image.Image:
+    image = Image.open(STATIC / name)
+    image.load()
+    return image
+
+
+def show_preview(
+    preview: SessionPreview,
+    pool: RenderPool,
+    history: EditHistory,
+    committed: dict,
+) -> None:
+    """
+    Show the last image of the preview, after taking the newest render, and
+    keep it in the history when it is the preview of the `committed` overrides.
+    """
+    pending = preview.pending
+    try:
+        preview.poll(pool)
+    except TimeoutError:
+        st.warning("Rendering the preview took too long.")
+    if preview.error is not None:
+        st.error(f"The preview could not be rendered: {preview.error}")
+    if (
+        preview.key != history.current["preview_key"]
+        and preview.completed(pool, committed)
+        and preview.image is not None
+    ):
+        history.link(preview.key, preview.image)
+    if preview.image is not None:
+        st.image(preview.image, width="stretch")
+    if preview.budget:
+        st.caption(
+            f"Level of detail: {preview.image_detail} shown, {preview.detail} for "
+            f"the next edits (0 is full, {len(DETAIL_LEVELS) - 1} the lowest)"
+        )
+    if preview.pending:
+        st.caption("Rendering the preview...")
+    elif pending:
+        # Rerun the whole app once the image landed, to stop polling
+        st.rerun()
+
+
+def show_comparison(comparison: StyleComparison, pool: RenderPool) -> None:
+    """Show the styles compared, after taking the newest renders."""
+    pending = comparison.pending
+    try:
+        comparison.poll(pool)
+    except TimeoutError:
+        st.warning("Rendering the styles took too long.")
+    cols = st.columns(min(3, len(comparison.styles)) or 1)
+    for i, name in enumerate(comparison.styles):
+        col = cols[i % len(cols)]
+        result = comparison.results.get(name)
+        if result is None:
+            col.caption(f"Rendering {name}...")
+        elif result["error"] is not None:
+            col.error(f"{name} could not be rendered: {result['error']}")
+        else:
+            col.image(
+                result["image"],
+                caption=f"{name} · {1000 * result['seconds']:.0f} ms",
+                width="stretch",
+            )
+    if pending and not comparison.pending:
+        # Rerun the whole app once the styles landed, to stop polling
+        st.rerun()
+
+
+@st.cache_resource
+def get_library():
+    return StyleLibrary()
+
+
+def open_style(style_hash: str) -> bool:
+    """Replace the overrides of the session with a saved style."""
+    style = get_library().style(style_hash)
+    if style is None:
+        return False
+    overrides = RCOverrides()
+    overrides.update(style["values"], style["raw"])
+    st.session_state["overrides"] = overrides
+    st.session_state["df"] = DFHelper.update(DFHelper.empty(), style["raw"])
+    st.session_state["opened_style"] = style_hash
+    st.query_params["style"] = style_hash
+    return True
+
+
+def restore_snapshot(snapshot: Snapshot) -> None:
+    """Replace the overrides of the session with those of a snapshot."""
+    overrides = RCOverrides.from_params(snapshot["params"])
+    st.session_state["overrides"] = overrides
+    st.session_state["df"] = DFHelper.update(DFHelper.empty(), overrides.raw)
+    # The value of the rcParam selected would be merged into the restored
+    # overrides, it is unselected on the next run, before its widget
+    st.session_state["unselect_param"] = True
+
+
+def get_session_id() -> str:
+    ctx = get_script_run_ctx()
+    return "default" if ctx is None else ctx.session_id
 
 
 def main():
+    startup_timings = get_startup_timings()
+    timer = RerunTimer(settings.PROFILE)
+
     # Decrease whitespace at the top of the document.
     st.markdown(
         """
@@ -137,6 +168,14 @@ def main():
     )
     col_sidebar, col_content = st.columns([1, 3])
 
+    # Open the style linked in the URL, once
+    library = get_library()
+    style_hash = st.query_params.get("style")
+    if style_hash and style_hash != st.session_state.get("opened_style"):
+        if not open_style(style_hash):
+            st.session_state["opened_style"] = style_hash
+            st.error(f"No saved style {style_hash}")
+
     # UI: Sidebar
     with col_sidebar:
         # UI: Header
@@ -145,19 +184,22 @@ def main():
             unsafe_allow_html=True,
         )
         st.image(
-            Image.open("./static/logo_light.png"),
+            static_file("logo_light.png"),
             caption="Edit styles, persist changes, export.",
             use_column_width=True,
         )
         st.markdown("<div style='margin: 0px;'><br></hdiv>", unsafe_allow_html=True)
 
         # UI: rcParam selector
+        if st.session_state.pop("unselect_param", False):
+            st.session_state["param"] = None
         param = st.selectbox(
             "Edit an rcParam",
-            st.session_state["rckeys"],
+            RCHelper.sorted_keys(),
             index=None,
             placeholder="e.g., axes.grid",
             label_visibility="visible",
+            key="param",
         )
         if param is None:
             value = st.text_input(
@@ -167,21 +209,14 @@ def main():
                 disabled=param is None,
             )
         else:
-            select_options = get_keys_options()
             write_to = st
             widget_is_picker = False
-            if (
-                "color" in param
-                and "patch.force_edgecolor" not in param
-                and "pcolor" not in param
-                and "pdf.inheritcolor" not in param
-            ):
+            if RCHelper.is_color(param):
                 cola, colb = st.columns([1, 1])
                 widget_is_picker = cola.toggle("Name/Picker")
                 write_to = colb
-            widget_desc = RCHelper.get_input_widget_description(
-                param, select_options=select_options, widget_is_picker=widget_is_picker
-            )
+            with timer.span("widget_description"):
+                widget_desc = widget_description(param, widget_is_picker)
             value = getattr(write_to, widget_desc["widget"])(
                 *widget_desc["args"], **widget_desc["kwargs"]
             )
@@ -193,69 +228,256 @@ def main():
             "Persist change", use_container_width=True, disabled=param is None
         )
         if addme and value is not None and param is not None:
-            RCHelper.insert(st.session_state["rc"], param, value)
+            st.session_state["overrides"].set(param, value)
             DFHelper.insert(st.session_state["df"], param, value)
+        # Filled once the edits of this rerun are recorded
+        history_row = st.container()
+
+        # UI: Import of styles, loaded in one operation
+        with st.expander("Import styles"):
+            upload = st.file_uploader(
+                "Style file or zip of style files",
+                type=["mplstyle", "zip"],
+                label_visibility="collapsed",
+            )
+            builtin = st.selectbox(
+                "Built-in style",
+                builtin_style_names(),
+                index=None,
+                placeholder="or a built-in style",
+                label_visibility="collapsed",
+            )
+            if st.button(
+                "Import",
+                use_container_width=True,
+                disabled=upload is None and builtin is None,
+            ):
+                with timer.span("import_styles"):
+                    imported = imported_style()
+                    if builtin is not None:
+                        import_builtin(builtin, imported)
+                    if upload is not None:
+                        import_file(upload.name, upload, imported)
+                    st.session_state["overrides"].update(
+                        imported["values"], imported["raw"]
+                    )
+                    st.session_state["df"] = DFHelper.update(
+                        st.session_state["df"], imported["raw"]
+                    )
+                st.success(f"Imported {len(imported['values'])} rcParams")
+                for error in imported["errors"]:
+                    # Errors of whole files are on line 0
+                    where = f", line {error['line']}" if error["line"] else ""
+                    st.error(f"{error['source']}{where}: {error['message']}")
+
+        # UI: Library of saved styles, shared by all sessions
+        with st.expander("Style library"):
+            name = st.text_input(
+                "Name", placeholder="Name of the style", label_visibility="collapsed"
+            )
+            if st.button("Save", use_container_width=True, disabled=not name):
+                to_save = st.session_state["overrides"].diff()
+                version = library.save(name, to_save)
+                preview = st.session_state["preview"]
+                if preview.completed(get_render_pool(), to_save):
+                    library.set_preview(version["hash"], preview.key, preview.image)
+                st.session_state["opened_style"] = version["hash"]
+                st.query_params["style"] = version["hash"]
+                st.success(f"Saved {name} v{version['version']}, linked in the URL")
+            query = st.text_input(
+                "Search",
+                placeholder="Search saved styles",
+                label_visibility="collapsed",
+            )
+            with timer.span("search_library"):
+                found = library.search(query, limit=20)
+            chosen = st.selectbox(
+                "Saved styles",
+                found,
+                index=None,
+                format_func=lambda v: f"{v['name']} v{v['version']} · {v['hash'][:8]}",
+                placeholder="Choose a saved style",
+                label_visibility="collapsed",
+            )
+            if st.button("Open", use_container_width=True, disabled=chosen is None):
+                open_style(chosen["hash"])
+                st.rerun()
 
         # UI: Dataframe editor
         df_edit = st.data_editor(st.session_state["df"], num_rows="dynamic")
         # Check that all keys exist
-        for key in df_edit.index:
-            if key not in st.session_state["rc"].keys():
-                key_sugest = get_close_matches(key, st.session_state["rckeys"], n=1)[0]
-                st.error(f"Invalid rcParam '{key}'. Do you mean '{key_sugest}'?")
-
-        # Update all keys with new values, but also revert any keys not present
-        # in edited_df with default value
-        for key in st.session_state["rc"].keys():
-            replace = key in df_edit.index and df_edit.loc[key]["Value"] is not None
-            val = (
-                df_edit.loc[key]["Value"]
-                if replace
-                else st.session_state["rc_default"][key]
+        with timer.span("validate_keys"):
+            for key in df_edit.index:
+                if key not in RCHelper.defaults():
+                    error = f"Invalid rcParam '{key}'."
+                    for key_sugest in suggest(key):
+                        error += f" Do you mean '{key_sugest}'?"
+                    st.error(error)
+
+        # Apply the keys added, changed or removed in the table, keys not in
+        # the table revert to their default value
+        with timer.span("sync_overrides"):
+            errors = st.session_state["overrides"].sync(
+                dict(zip(df_edit.index, df_edit["Value"]))
+            )
+        for key, error in errors.items():
+            st.error(f"Invalid value for '{key}': {error}")
+
+        # UI: Undo and redo, of the changes persisted, table edits, imports
+        # and styles opened
+        history = st.session_state["history"]
+        history.record(st.session_state["overrides"].params)
+        with history_row:
+            col_undo, col_redo = st.columns([1, 1])
+            undo = col_undo.button(
+                "Undo", use_container_width=True, disabled=not history.can_undo
+            )
+            redo = col_redo.button(
+                "Redo", use_container_width=True, disabled=not history.can_redo
+            )
+            if undo or redo:
+                restore_snapshot(history.undo() if undo else history.redo())
+                st.rerun()
+        families = st.session_state["overrides"].values.get("font.family", ())
+        for family in missing_families(families):
+            st.warning(
+                f"Font family '{family}' is not installed, another font is used."
             )
-            RCHelper.insert(st.session_state["rc"], key, val)
         # st.session_state["df"] = df_edit # Not sure if this is required or not
 
         # UI: Download button
         enable_download = not st.session_state["df"].empty
-        contents = BytesIO()
-        if enable_download:
-            RCHelper.write_binary(st.session_state["rc"], out=contents)
+        col_format, col_full = st.columns([1, 1])
+        export_format = col_format.selectbox(
+            "Format", list(FORMATS), label_visibility="collapsed"
+        )
+        export_full = col_full.toggle("All rcParams")
+        # Generated only when the button is clicked
+        export_values = st.session_state["overrides"].diff()
         st.download_button(
             "Download",
-            contents,
-            file_name="rcParams.mplstyle",
-            mime="text/csv",
+            lambda: export_style(export_values, export_format, export_full),
+            file_name=file_name("rcParams", export_format),
+            mime=FORMATS[export_format][1],
             use_container_width=True,
             disabled=not enable_download,
         )
 
+        # UI: Memory gauge of the server, its render workers and this session
+        usage = get_render_pool().memory_usage()
+        rss = "?" if usage["rss_bytes"] is None else f"{usage['rss_bytes'] / 2**20:.0f}"
+        session_kib = deep_sizeof(dict(st.session_state)) / 2**10
+        st.caption(
+            f"Live figures: {usage['live_figures']} · Memory: {rss} MiB · "
+            f"Session: {session_kib:.1f} KiB"
+        )
+
     # UI: Plots
     with col_content:
-        rc_tmp = st.session_state["rc"].copy()
+        committed = st.session_state["overrides"].diff()
+        overrides = dict(committed)
         if value is not None and param is not None:
-            RCHelper.insert(rc_tmp, param, value)
-        figwidth_px = streamlit_js_eval(js_expressions="screen.width", want_output=True)
-        if figwidth_px is None:
-            figwidth_px = 1000
+            try:
+                overrides[param] = RCOverrides.validate(param, value)
+            except ValueError as e:
+                st.error(f"Invalid value for '{param}': {e}")
+            else:
+                if overrides[param] == RCHelper.defaults()[param]:
+                    del overrides[param]
+        with timer.span("screen_width"):
+            figwidth_px = streamlit_js_eval(
+                js_expressions="screen.width", want_output=True
+            )
+        figsize_px = preview_size(figwidth_px)
+
+        # Only re-render when the effective overrides or the size changed
+        pool = get_render_pool()
+        if timer.enabled:
+            timer.info["rc_diff_size"] = len(overrides)
+            timer.info["cache_hit"] = pool.key(overrides, figsize_px) in pool.cache
+            timer.info["render_cache"] = pool.cache.stats()
+        # The preview renders in the background, the last image completed
+        # (or a draft) is shown meanwhile and polled for until it lands
+        preview = st.session_state["preview"]
+        # Previews of the edits of the session are kept in their history,
+        # and those of saved styles are stored in the library
+        key = pool.key(overrides, figsize_px)
+        if key not in pool.cache:
+            image = history.preview(key) or library.preview(key)
+            if image is not None:
+                pool.cache.put(key, image)
+        with timer.span("render"):
+            preview.request(pool, get_session_id(), overrides, figsize_px)
+        run_every = settings.PREVIEW_POLL_INTERVAL if preview.pending else None
+        st.fragment(show_preview, run_every=run_every)(
+            preview, pool, history, committed
+        )
 
-        with plt.rc_context(rc_tmp):
-            fig = plot_figure((0.5 * figwidth_px, 0.25 * figwidth_px))
-            st.pyplot(fig)
+        # UI: Comparison of styles, rendered concurrently
+        with st.expander("Compare styles"):
+            saved = {
+                f"{v['name']} v{v['version']}": v["hash"] for v in library.search()
+            }
+            compared = st.multiselect(
+                "Styles",
+                [CURRENT_STYLE] + builtin_style_names() + list(saved),
+                placeholder="Choose styles to compare",
+                label_visibility="collapsed",
+            )
+            styles = {}
+            for name in compared:
+                if name == CURRENT_STYLE:
+                    styles[name] = overrides
+                elif name in saved:
+                    style = library.style(saved[name])
+                    styles[name] = {} if style is None else style["values"]
+                else:
+                    styles[name] = style_overrides(name)
+            comparison = st.session_state["comparison"]
+            with timer.span("compare"):
+                comparison.request(pool, get_session_id(), styles, figsize_px)
+            run_every = settings.PREVIEW_POLL_INTERVAL if comparison.pending else None
+            st.fragment(show_comparison, run_every=run_every)(comparison, pool)
+
+    # UI: Timings of this rerun
+    if timer.enabled:
+        with col_sidebar.expander("Timings"):
+            st.table(
+                {
+                    "Stage": list(timer.spans) + ["total"],
+                    "ms": [f"{1000 * t:.1f}" for t in timer.spans.values()]
+                    + [f"{1000 * timer.total():.1f}"],
+                }
+            )
+            st.caption("Warm-up of the server process")
+            st.table(
+                {
+                    "Stage": list(startup_timings),
+                    "ms": [f"{1000 * t:.1f}" for t in startup_timings.values()],
+                }
+            )
+            st.caption("Render cache of the server process")
+            st.table({"Value": timer.info["render_cache"]})
+        timer.record(get_session_id(), settings.PROFILE_LOG)
 
 
 if __name__ == "__main__":
-    im = Image.open("./static/sphx_glr_logos2_002.png")
-    st.set_page_config(page_title="Matplotlib Styles", layout="wide", page_icon=im)
+    st.set_page_config(
+        page_title="Matplotlib Styles",
+        layout="wide",
+        page_icon=static_image("sphx_glr_logos2_002.png"),
+    )
 
     # Store state variables
-    if "rc_default" not in st.session_state:
-        st.session_state["rc_default"] = RCHelper.default()
-    if "rc" not in st.session_state:
-        st.session_state["rc"] = RCHelper.default()
+    if "overrides" not in st.session_state:
+        st.session_state["overrides"] = RCOverrides()
     if "df" not in st.session_state:
         st.session_state["df"] = DFHelper.empty()
-    if "rckeys" not in st.session_state:
-        st.session_state["rckeys"] = RCHelper.get_sorted_keys(st.session_state["rc"])
+    if "history" not in st.session_state:
+        st.session_state["history"] = EditHistory(st.session_state["overrides"].params)
+    if "comparison" not in st.session_state:
+        st.session_state["comparison"] = StyleComparison()
+    if "preview" not in st.session_state:
+        st.session_state["preview"] = SessionPreview()
 
     main()
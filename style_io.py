@@ -0,0 +1,320 @@
+"""
+Export and import of styles.
+
+Styles are exported as `.mplstyle` files, JSON or Python `rc_context` dicts.
+Only the overrides of a style are written by default, `full=True` writes
+every rcParam. Many styles are streamed into a zip, one entry at a time:
+
+    python style_io.py -o styles.zip --format json --styles-dir my_styles
+
+Styles are imported from `.mplstyle` files, built-in styles or zips of
+`.mplstyle` files. All their lines are parsed and validated in one pass,
+with the errors reported by line.
+"""
+
+import argparse
+import json
+import sys
+import zipfile
+import zlib
+from enum import Enum
+from typing import IO, Any, BinaryIO, Iterable, Mapping, Optional, Sequence, TypedDict
+
+import matplotlib as mpl
+import matplotlib.style
+from cycler import Cycler
+from matplotlib import cbook
+
+from helper import RCHelper, RCOverrides
+from key_index import suggest
+
+# name: (file extension, mime type)
+FORMATS = {
+    "mplstyle": ("mplstyle", "text/plain"),
+    "json": ("json", "application/json"),
+    "python": ("py", "text/x-python"),
+}
+
+
+# Values written instead of `None` in `.mplstyle` files, where it is invalid
+_MPLSTYLE_NONE = {"savefig.bbox": "standard"}
+
+
+def style_values(overrides: Mapping[str, Any], full: bool = False) -> dict:
+    """Sorted values to export, with the defaults of the other keys if `full`."""
+    if not full:
+        return {k: overrides[k] for k in sorted(overrides)}
+    return {
+        k: overrides.get(k, RCHelper.defaults()[k])
+        for k in RCHelper.sorted_keys()
+        # Keys ignored by style files, some of them cannot be written at all
+        if k not in mpl.style.core.STYLE_BLACKLIST
+    }
+
+
+def format_value(val) -> str:
+    """`val` as written in `.mplstyle` files."""
+    if isinstance(val, Enum):
+        val = val.value
+    if isinstance(val, Cycler):
+        # Double quotes keep `#` from starting a comment
+        text = repr(val).replace("'", '"')
+    elif isinstance(val, (list, tuple)):
+        text = ", ".join(format_value(v) for v in val)
+    else:
+        text = str(val)
+    if "#" in text and '"' not in text:
+        text = f'"{text}"'
+    return text
+
+
+def _plain(val):
+    """`val` as a JSON value, falling back to its `.mplstyle` string."""
+    if isinstance(val, Enum):
+        return val.value
+    if val is None or isinstance(val, (bool, int, float, str)):
+        return val
+    if isinstance(val, (list, tuple)):
+        return [_plain(v) for v in val]
+    return format_value(val)
+
+
+def to_mplstyle(values: Mapping[str, Any]) -> str:
+    lines = []
+    for k, v in values.items():
+        text = _MPLSTYLE_NONE[k] if v is None and k in _MPLSTYLE_NONE else None
+        lines.append(f"{k}: {text or format_value(v)}\n")
+    return "".join(lines)
+
+
+def _literal(val):
+    """`val` as a Python literal, or a cycler."""
+    if isinstance(val, Enum):
+        return val.value
+    if isinstance(val, (list, tuple)):
+        return type(val)(_literal(v) for v in val)
+    return val
+
+
+def to_json(values: Mapping[str, Any]) -> str:
+    return json.dumps({k: _plain(v) for k, v in values.items()}, indent=2) + "\n"
+
+
+def to_python(values: Mapping[str, Any]) -> str:
+    items = {k: _literal(v) for k, v in values.items()}
+    lines = ["import matplotlib as mpl"]
+    if any(isinstance(v, Cycler) for v in items.values()):
+        lines.append("from cycler import cycler")
+    lines += ["", "rc = {"]
+    lines += [f"    {k!r}: {v!r}," for k, v in items.items()]
+    lines += ["}", "", "# with mpl.rc_context(rc):", "#     ...", ""]
+    return "\n".join(lines)
+
+
+_WRITERS = {"mplstyle": to_mplstyle, "json": to_json, "python": to_python}
+
+
+def export_style(
+    overrides: Mapping[str, Any], fmt: str = "mplstyle", full: bool = False
+) -> bytes:
+    return _WRITERS[fmt](style_values(overrides, full)).encode("utf8")
+
+
+def file_name(name: str, fmt: str) -> str:
+    return f"{name}.{FORMATS[fmt][0]}"
+
+
+def write_zip(
+    styles: Iterable[tuple[str, Mapping[str, Any]]],
+    out: BinaryIO,
+    fmt: str = "mplstyle",
+    full: bool = False,
+) -> None:
+    """
+    Write `styles` (name, overrides) to a zip in `out`, one at a time, so
+    that only one style is held in memory when `styles` is lazy.
+    """
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, overrides in styles:
+            zf.writestr(file_name(name, fmt), export_style(overrides, fmt, full))
+
+
+def style_overrides(spec: str) -> dict:
+    """Overrides of a built-in style name or `.mplstyle` path."""
+    if spec == "default":
+        return {}
+    if spec in mpl.style.library:
+        rc = mpl.style.library[spec]
+    else:
+        rc = mpl.rc_params_from_file(spec, use_default_template=False)
+    return RCHelper.diff(rc, RCHelper.defaults())
+
+
+class StyleError(TypedDict):
+    source: str
+    line: int
+    message: str
+
+
+class ImportedStyle(TypedDict):
+    values: dict[str, Any]  # Validated values
+    raw: dict[str, str]  # Values as written in the style files
+    errors: list[StyleError]
+
+
+def imported_style() -> ImportedStyle:
+    return ImportedStyle(values={}, raw={}, errors=[])
+
+
+def import_mplstyle(
+    text: str, source: str = "<style>", into: Optional[ImportedStyle] = None
+) -> ImportedStyle:
+    """
+    Parse and validate the lines of a `.mplstyle` file.
+
+    Lines are parsed as `matplotlib.rc_params_from_file` does. Valid values
+    are added to `into`, if given, overriding those of previous styles.
+    """
+    style = imported_style() if into is None else into
+
+    def error(line: int, message: str) -> None:
+        style["errors"].append(StyleError(source=source, line=line, message=message))
+
+    for line_no, line in enumerate(text.splitlines(), 1):
+        try:
+            stripped = cbook._strip_comment(line)
+        except ValueError as e:
+            error(line_no, str(e))
+            continue
+        if not stripped:
+            continue
+        key, sep, val = stripped.partition(":")
+        key, val = key.strip(), val.strip()
+        if not sep:
+            error(line_no, "Missing colon")
+            continue
+        if val.startswith('"') and val.endswith('"'):
+            val = val[1:-1]
+        if key not in RCHelper.defaults():
+            message = f"Unknown rcParam '{key}'."
+            for key_sugest in suggest(key):
+                message += f" Do you mean '{key_sugest}'?"
+            error(line_no, message)
+        elif key in mpl.style.core.STYLE_BLACKLIST:
+            error(line_no, f"'{key}' is not related to style, ignored")
+        else:
+            try:
+                style["values"][key] = RCOverrides.validate(key, val)
+            except ValueError as e:
+                error(line_no, f"Invalid value for '{key}': {e}")
+            else:
+                style["raw"][key] = val
+    return style
+
+
+def builtin_style_names() -> list[str]:
+    return sorted(s for s in mpl.style.available if not s.startswith("_"))
+
+
+def import_builtin(name: str, into: Optional[ImportedStyle] = None) -> ImportedStyle:
+    """Import a built-in style, as written in its `.mplstyle` file."""
+    rc = mpl.style.library[name]
+    values = {k: v for k, v in rc.items() if k not in mpl.style.core.STYLE_BLACKLIST}
+    return import_mplstyle(to_mplstyle(values), name, into)
+
+
+def _file_error(style: ImportedStyle, source: str, message: str) -> None:
+    # Errors of a whole file, which is skipped, are reported on line 0
+    style["errors"].append(StyleError(source=source, line=0, message=message))
+
+
+def _import_bytes(data: bytes, source: str, style: ImportedStyle) -> None:
+    try:
+        text = data.decode("utf8")
+    except UnicodeDecodeError as e:
+        _file_error(style, source, f"Not a UTF-8 text file: {e}")
+        return
+    import_mplstyle(text, source, style)
+
+
+def import_zip(
+    file: IO[bytes], into: Optional[ImportedStyle] = None, source: str = "<zip>"
+) -> ImportedStyle:
+    """
+    Import the `.mplstyle` files of a zip, in order of their names. A zip, or
+    member, which cannot be read is reported as an error of `source`, or of
+    the member.
+    """
+    style = imported_style() if into is None else into
+    try:
+        zf = zipfile.ZipFile(file)
+    except (zipfile.BadZipFile, OSError) as e:
+        _file_error(style, source, f"Not a valid zip file: {e}")
+        return style
+    with zf:
+        for name in sorted(zf.namelist()):
+            if not name.endswith(".mplstyle"):
+                continue
+            try:
+                data = zf.read(name)
+            except (
+                zipfile.BadZipFile,
+                zlib.error,
+                RuntimeError,
+                NotImplementedError,
+            ) as e:
+                # Corrupted, encrypted or compressed with an unsupported method
+                _file_error(style, name, f"Cannot be read from the zip: {e}")
+                continue
+            _import_bytes(data, name, style)
+    return style
+
+
+def import_file(
+    name: str, file: IO[bytes], into: Optional[ImportedStyle] = None
+) -> ImportedStyle:
+    """Import a `.mplstyle` file or a zip of them."""
+    if name.endswith(".zip"):
+        return import_zip(file, into, name)
+    style = imported_style() if into is None else into
+    _import_bytes(file.read(), name, style)
+    return style
+
+
+def main(argv=None):
+    # Imported here, not to import the plotting code with the export functions
+    from batch_render import find_styles
+
+    parser = argparse.ArgumentParser(description="Export styles to a zip.")
+    parser.add_argument("-o", "--output", default="styles.zip", help="zip file")
+    parser.add_argument(
+        "--styles-dir",
+        action="append",
+        default=[],
+        help="directory of .mplstyle files, can be repeated",
+    )
+    parser.add_argument(
+        "--no-builtin", action="store_true", help="skip the built-in styles"
+    )
+    parser.add_argument("--format", default="mplstyle", choices=list(FORMATS))
+    parser.add_argument(
+        "--full", action="store_true", help="write every rcParam, not the overrides"
+    )
+    args = parser.parse_args(argv)
+
+    styles: Sequence[tuple[str, str]] = list(
+        find_styles(args.styles_dir, builtin=not args.no_builtin).items()
+    )
+    with open(args.output, "wb") as out:
+        write_zip(
+            ((name, style_overrides(spec)) for name, spec in styles),
+            out,
+            args.format,
+            args.full,
+        )
+    print(f"Exported {len(styles)} styles to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+"""
+Library of saved styles, in a SQLite database.
+
+Styles are stored once per content: the hash of their overrides exported as
+a `.mplstyle` file (sorted keys, canonical values). Saving a style under a
+name adds a version pointing to that content, unless it is the latest
+version already. Previews rendered for a style are stored with it, keyed by
+their render cache key, so reopening it does not render it again.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from threading import Lock
+from typing import Any, Iterator, Mapping, Optional, TypedDict
+
+import settings
+from style_io import ImportedStyle, export_style, import_mplstyle
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS styles (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    hash TEXT NOT NULL REFERENCES styles (hash),
+    created REAL NOT NULL,
+    PRIMARY KEY (name, version)
+);
+CREATE INDEX IF NOT EXISTS versions_hash ON versions (hash);
+CREATE TABLE IF NOT EXISTS previews (
+    key TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES styles (hash),
+    image BLOB NOT NULL
+);
+"""
+
+# Saved styles kept parsed by a library
+PARSED_STYLES = 256
+
+
+class StyleVersion(TypedDict):
+    name: str
+    version: int
+    hash: str
+    created: float
+
+
+def canonical(overrides: Mapping[str, Any]) -> str:
+    """Content of a style, the same for equal overrides."""
+    return export_style(overrides).decode("utf8")
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+
+class StyleLibrary:
+    """Saved styles, shared by every session of the server."""
+
+    def __init__(self, path: str = settings.LIBRARY_PATH) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._parsed: OrderedDict[str, ImportedStyle] = OrderedDict()
+        self._lock = Lock()
+        with self._connect() as db:
+            # Stored in the database, for every later connection
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per operation, sessions run in different threads
+        with closing(sqlite3.connect(self.path, timeout=10)) as db:
+            db.row_factory = sqlite3.Row
+            with db:
+                yield db
+
+    def save(self, name: str, overrides: Mapping[str, Any]) -> StyleVersion:
+        """Save `overrides` as the next version of `name`, if they changed."""
+        content = canonical(overrides)
+        style_hash = content_hash(content)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO styles VALUES (?, ?, ?)",
+                (style_hash, content, now),
+            )
+            latest = db.execute(
+                "SELECT * FROM versions WHERE name = ? ORDER BY version DESC LIMIT 1",
+                (name,),
+            ).fetchone()
+            if latest is not None and latest["hash"] == style_hash:
+                return StyleVersion(**latest)
+            version = 1 if latest is None else latest["version"] + 1
+            db.execute(
+                "INSERT INTO versions VALUES (?, ?, ?, ?)",
+                (name, version, style_hash, now),
+            )
+        return StyleVersion(name=name, version=version, hash=style_hash, created=now)
+
+    def load(self, style_hash: str) -> Optional[str]:
+        """Content of a style, as a `.mplstyle` file."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT content FROM styles WHERE hash = ?", (style_hash,)
+            ).fetchone()
+        return None if row is None else row["content"]
+
+    def style(self, style_hash: str) -> Optional[ImportedStyle]:
+        """Saved style, parsed once since its content never changes."""
+        with self._lock:
+            style = self._parsed.get(style_hash)
+            if style is not None:
+                self._parsed.move_to_end(style_hash)
+                return style
+        content = self.load(style_hash)
+        if content is None:
+            return None
+        style = import_mplstyle(content, style_hash)
+        with self._lock:
+            self._parsed[style_hash] = style
+            if len(self._parsed) > PARSED_STYLES:
+                self._parsed.popitem(last=False)
+        return style
+
+    def search(self, query: str = "", limit: int = 50) -> list[StyleVersion]:
+        """
+        Latest versions of the styles whose name contains `query`, or whose
+        hash or rcParams start with it, most recent first.
+        """
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._connect() as db:
+            rows = db.execute(
+                """
+                SELECT v.* FROM versions v JOIN styles s ON s.hash = v.hash
+                WHERE v.version = (
+                    SELECT MAX(version) FROM versions WHERE name = v.name
+                ) AND (
+                    v.name LIKE ?1 ESCAPE '\\'
+                    OR v.hash LIKE ?2 ESCAPE '\\'
+                    OR s.content LIKE ?2 ESCAPE '\\'
+                    OR s.content LIKE ?3 ESCAPE '\\'
+                )
+                ORDER BY v.created DESC LIMIT ?4
+                """,
+                (
+                    f"%{pattern}%",
+                    f"{pattern}%",
+                    f"%\n{pattern}%",
+                    limit,
+                ),
+            ).fetchall()
+        return [StyleVersion(**row) for row in rows]
+
+    def preview(self, key: str) -> Optional[bytes]:
+        """Preview stored under its render cache key, if any."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT image FROM previews WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else row["image"]
+
+    def set_preview(self, style_hash: str, key: str, image: bytes) -> None:
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO previews VALUES (?, ?, ?)",
+                (key, style_hash, image),
+            )
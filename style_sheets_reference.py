@@ -5,6 +5,11 @@
 # =======
 # * `plot_bar_graphs` added labels and legend
 # * `plot_figure` accepts figure size in pixels and returns the figure
+# * `plot_panel` and `plot_title` plot single panels of the figure, for
+#   compositing
+# * Sample data is generated once by `get_sample_data`, histograms pre-binned
+# * Figures are created with `new_figure`, outside of pyplot
+# * Panels can plot a fraction of the samples, for quicker previews
 
 
 """
@@ -29,45 +34,100 @@ See more details in :ref:`Customizing Matplotlib
 using style sheets<customizing-with-style-sheets>`.
 """
 
+import weakref
+from functools import lru_cache
+from typing import TypedDict
+
+import matplotlib as mpl
 import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.patches import Rectangle
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle, Rectangle
 
 # Fixing random state for reproducibility
 np.random.seed(19680801)
 
+HIST_PARAMS = ((10, 10), (4, 12), (50, 12), (6, 55))
 
-def plot_scatter(ax, prng, nb_samples=100):
-    """Scatter plot."""
-    for mu, sigma, marker in [(-0.5, 0.75, "o"), (0.75, 1.0, "s")]:
-        x, y = prng.normal(loc=mu, scale=sigma, size=(2, nb_samples))
-        ax.plot(x, y, ls="none", marker=marker)
-    ax.set_xlabel("X-label")
-    ax.set_title("Axes title")
-    return ax
 
+class SampleData(TypedDict):
+    scatter: list[np.ndarray]  # One (2, nb_samples) array per marker
+    image: np.ndarray
+    bars: np.ndarray
+    histograms: list[tuple[np.ndarray, np.ndarray]]  # (density, bin edges)
+    circles: np.ndarray
+
+
+def _read_only(arr):
+    arr.setflags(write=False)
+    return arr
+
+
+@lru_cache(maxsize=None)
+def get_sample_data() -> SampleData:
+    """
+    Data of the demonstration figure, generated once per process.
+
+    Values are drawn in the same order `plot_figure` used to draw them, from
+    a dedicated RandomState instance so all figures show the same "random"
+    values. Arrays are read-only since they are shared by every caller.
+    """
+    prng = np.random.RandomState(96917002)
+    scatter = [
+        _read_only(prng.normal(loc=mu, scale=sigma, size=(2, 100)))
+        for mu, sigma in [(-0.5, 0.75), (0.75, 1.0)]
+    ]
+    image = _read_only(prng.random_sample(size=(20, 20)))
+    bars = _read_only(prng.randint(5, 25, size=(2, 5)))
+    histograms = []
+    for a, b in HIST_PARAMS:
+        density, edges = np.histogram(
+            prng.beta(a, b, size=10000), bins=30, density=True
+        )
+        histograms.append((_read_only(density), _read_only(edges)))
+    circles = _read_only(prng.normal(scale=3, size=(15, 2)))
+    return SampleData(
+        scatter=scatter, image=image, bars=bars, histograms=histograms, circles=circles
+    )
 
-def plot_colored_lines(ax):
-    """Plot lines with colors following the style color cycle."""
-    t = np.linspace(-10, 10, 100)
+
+@lru_cache(maxsize=None)
+def _sigmoids(nb_colors, nb_points=100):
+    t = np.linspace(-10, 10, nb_points)
 
     def sigmoid(t, t0):
         return 1 / (1 + np.exp(-(t - t0)))
 
-    nb_colors = len(plt.rcParams["axes.prop_cycle"])
     shifts = np.linspace(-5, 5, nb_colors)
     amplitudes = np.linspace(1, 1.5, nb_colors)
-    for t0, a in zip(shifts, amplitudes):
-        ax.plot(t, a * sigmoid(t, t0), "-")
+    ys = _read_only(np.array([a * sigmoid(t, t0) for t0, a in zip(shifts, amplitudes)]))
+    return _read_only(t), ys
+
+
+def plot_scatter(ax, data, nb_samples=100):
+    """Scatter plot."""
+    for xy, marker in zip(data["scatter"], ["o", "s"]):
+        x, y = xy[:, :nb_samples]
+        ax.plot(x, y, ls="none", marker=marker)
+    ax.set_xlabel("X-label")
+    ax.set_title("Axes title")
+    return ax
+
+
+def plot_colored_lines(ax, nb_points=100):
+    """Plot lines with colors following the style color cycle."""
+    t, ys = _sigmoids(len(mpl.rcParams["axes.prop_cycle"]), nb_points)
+    for y in ys:
+        ax.plot(t, y, "-")
     ax.set_xlim(-10, 10)
     return ax
 
 
-def plot_bar_graphs(ax, prng, min_value=5, max_value=25, nb_samples=5):
+def plot_bar_graphs(ax, data):
     """Plot two bar graphs side by side, with letters as x-tick labels."""
-    x = np.arange(nb_samples)
-    ya, yb = prng.randint(min_value, max_value, size=(2, nb_samples))
+    ya, yb = data["bars"]
+    x = np.arange(len(ya))
     width = 0.25
     ax.bar(x, ya, width, label="Bar 1")
     ax.bar(x + width, yb, width, color="C2", label="Bar 2")
@@ -76,7 +136,7 @@ def plot_bar_graphs(ax, prng, min_value=5, max_value=25, nb_samples=5):
     return ax
 
 
-def plot_colored_circles(ax, prng, nb_samples=15):
+def plot_colored_circles(ax, data, nb_samples=15):
     """
     Plot circle patches.
 
@@ -84,16 +144,14 @@ def plot_colored_circles(ax, prng, nb_samples=15):
     the color cycle, because different styles may have different numbers
     of colors.
     """
-    for sty_dict, j in zip(plt.rcParams["axes.prop_cycle"](), range(nb_samples)):
-        ax.add_patch(
-            plt.Circle(
-                prng.normal(scale=3, size=2), radius=1.0, color=sty_dict["color"]
-            )
-        )
+    for sty_dict, center in zip(
+        mpl.rcParams["axes.prop_cycle"](), data["circles"][:nb_samples]
+    ):
+        ax.add_patch(Circle(center, radius=1.0, color=sty_dict["color"]))
     ax.grid(visible=True)
 
     # Add title for enabling grid
-    plt.title("ax.grid(True)", family="monospace", fontsize="small")
+    ax.set_title("ax.grid(True)", family="monospace", fontsize="small")
 
     ax.set_xlim([-4, 8])
     ax.set_ylim([-5, 6])
@@ -101,23 +159,21 @@ def plot_colored_circles(ax, prng, nb_samples=15):
     return ax
 
 
-def plot_image_and_patch(ax, prng, size=(20, 20)):
+def plot_image_and_patch(ax, data):
     """Plot an image with random values and superimpose a circular patch."""
-    values = prng.random_sample(size=size)
-    ax.imshow(values, interpolation="none")
-    c = plt.Circle((5, 5), radius=5, label="patch")
+    ax.imshow(data["image"], interpolation="none")
+    c = Circle((5, 5), radius=5, label="patch")
     ax.add_patch(c)
     # Remove ticks
     ax.set_xticks([])
     ax.set_yticks([])
 
 
-def plot_histograms(ax, prng, nb_samples=10000):
+def plot_histograms(ax, data):
     """Plot 4 histograms and a text annotation."""
-    params = ((10, 10), (4, 12), (50, 12), (6, 55))
-    for a, b in params:
-        values = prng.beta(a, b, size=nb_samples)
-        ax.hist(values, histtype="stepfilled", bins=30, alpha=0.8, density=True)
+    # Histograms are pre-binned, draw them from their bin weights
+    for density, edges in data["histograms"]:
+        ax.hist(edges[:-1], edges, weights=density, histtype="stepfilled", alpha=0.8)
 
     # Add a small annotation.
     ax.annotate(
@@ -135,22 +191,43 @@ def plot_histograms(ax, prng, nb_samples=10000):
     return ax
 
 
-def plot_figure(figsize_px=(600, 300)):
-    """Setup and plot the demonstration figure with a given style."""
-    # Use a dedicated RandomState instance to draw the same "random" values
-    # across the different figures.
-    prng = np.random.RandomState(96917002)
-    dpi = plt.rcParams["figure.dpi"]
-    figsize = tuple(px / dpi for px in figsize_px)
-    fig, axs = plt.subplots(
-        ncols=3, nrows=2, figsize=figsize
-    )  # , layout="constrained")
-    axs = axs.flat
+PANELS = (
+    "scatter",
+    "image_and_patch",
+    "bar_graphs",
+    "colored_lines",
+    "histograms",
+    "colored_circles",
+)
+NROWS, NCOLS = 2, 3
+
+
+def _plot_panel(ax, name, data, samples=1.0):
+    if name == "scatter":
+        plot_scatter(ax, data, max(1, round(100 * samples)))
+    elif name == "image_and_patch":
+        plot_image_and_patch(ax, data)
+    elif name == "bar_graphs":
+        plot_bar_graphs(ax, data)
+    elif name == "colored_lines":
+        plot_colored_lines(ax, max(2, round(100 * samples)))
+    elif name == "histograms":
+        plot_histograms(ax, data)
+        # add divider
+        rec = Rectangle((1 + 0.025, -2), 0.05, 16, clip_on=False, color="gray")
+        rec.set_in_layout(False)
+        ax.add_artist(rec)
+    elif name == "colored_circles":
+        plot_colored_circles(ax, data)
+    else:
+        raise ValueError(f"Unknown panel '{name}'")
+
 
+def _plot_suptitle(fig, **kwargs):
     # make a suptitle, in the same style for all subfigures,
     # except those with dark backgrounds, which get a lighter color:
     background_color = mcolors.rgb_to_hsv(
-        mcolors.to_rgb(plt.rcParams["figure.facecolor"])
+        mcolors.to_rgb(mpl.rcParams["figure.facecolor"])
     )[2]
     if background_color < 0.5:
         title_color = [0.8, 0.8, 1]
@@ -164,23 +241,74 @@ def plot_figure(figsize_px=(600, 300)):
         fontsize=22,
         fontfamily="DejaVu Sans",
         fontweight="normal",
+        **kwargs,
     )
 
-    plot_scatter(axs[0], prng)
-    plot_image_and_patch(axs[1], prng)
-    plot_bar_graphs(axs[2], prng)
-    plot_colored_lines(axs[3])
-    plot_histograms(axs[4], prng)
-    plot_colored_circles(axs[5], prng)
 
-    # add divider
-    rec = Rectangle((1 + 0.025, -2), 0.05, 16, clip_on=False, color="gray")
+# Figures created by this module which have not been garbage collected yet
+LIVE_FIGURES: weakref.WeakSet = weakref.WeakSet()
+
+
+def new_figure(**kwargs):
+    """Create a figure on an Agg canvas, without registering it with pyplot."""
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    LIVE_FIGURES.add(fig)
+    return fig
+
+
+def _figsize(figsize_px):
+    dpi = mpl.rcParams["figure.dpi"]
+    return tuple(px / dpi for px in figsize_px)
+
+
+def plot_figure(figsize_px=(600, 300), fig=None, samples=1.0):
+    """
+    Setup and plot the demonstration figure with a given style.
 
-    axs[4].add_artist(rec)
+    The figure is created with `new_figure` unless `fig` is given, e.g. a
+    pyplot figure to show it. Scatter points and line vertices are plotted
+    for a `samples` fraction.
+    """
+    data = get_sample_data()
+    figsize = _figsize(figsize_px)
+    if fig is None:
+        fig = new_figure(figsize=figsize)
+    else:
+        fig.set_size_inches(figsize)
+    axs = fig.subplots(ncols=NCOLS, nrows=NROWS)  # , layout="constrained")
+    _plot_suptitle(fig)
+    for ax, name in zip(axs.flat, PANELS):
+        _plot_panel(ax, name, data, samples)
+    return fig
+
+
+def plot_panel(name, figsize_px=(600, 300), samples=1.0):
+    """
+    Plot a single panel of the demonstration figure, in its cell of the grid
+    of the whole figure, on a transparent background.
+
+    The figure has no layout engine: the cells depend on the `figure.subplot`
+    rcParams only, so panels plotted on their own can be composited over
+    `plot_title` as if plotted together.
+    """
+    fig = new_figure(figsize=_figsize(figsize_px), layout="none")
+    fig.patch.set_visible(False)
+    ax = fig.add_subplot(fig.add_gridspec(NROWS, NCOLS)[PANELS.index(name)])
+    _plot_panel(ax, name, get_sample_data(), samples)
+    return fig
+
+
+def plot_title(figsize_px=(600, 300)):
+    """Plot the background and the title of the demonstration figure."""
+    fig = new_figure(figsize=_figsize(figsize_px), layout="none")
+    _plot_suptitle(fig)
     return fig
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     # Set up a list of all available styles, in alphabetical order but
     # the `default` and `classic` ones, which will be forced resp. in
     # first and second position.
@@ -196,6 +324,6 @@ if __name__ == "__main__":
     for style_label in style_list:
         with plt.rc_context({"figure.max_open_warning": len(style_list)}):
             with plt.style.context(style_label):
-                plot_figure()
+                plot_figure(fig=plt.figure())
 
     plt.show()
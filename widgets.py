@@ -0,0 +1,29 @@
+"""Widget descriptions of every rcParam, built once per process."""
+
+from functools import lru_cache
+
+from font_catalog import family_options, font_label
+from helper import InputsDict, RCHelper
+from rc_schema import get_keys_options
+
+
+@lru_cache(maxsize=None)
+def widget_table() -> dict[tuple[str, bool], InputsDict]:
+    """Widget description by key, and by whether colors use a picker."""
+    select_options = get_keys_options()
+    font_options = family_options()
+    return {
+        (key, picker): RCHelper.get_input_widget_description(
+            key,
+            select_options=select_options,
+            widget_is_picker=picker,
+            font_options=font_options,
+            font_label=font_label,
+        )
+        for key in RCHelper.sorted_keys()
+        for picker in ((False, True) if RCHelper.is_color(key) else (False,))
+    }
+
+
+def widget_description(key: str, widget_is_picker: bool = False) -> InputsDict:
+    return widget_table()[(key, widget_is_picker and RCHelper.is_color(key))]